@@ -7,6 +7,7 @@
 
 from .video_processer import VideoProcesser
 from .video_image_converter import VideoImageConverter
+from .batch import BatchProcesser
 
 
-__all__ = ['VideoProcesser', 'VideoImageConverter']
+__all__ = ['VideoProcesser', 'VideoImageConverter', 'BatchProcesser']
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : batch.py
+'''
+
+import os
+import json
+import glob
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from .utils import mkdir, set_verbose, progress, log
+from .video_processer import VideoProcesser
+from .video_image_converter import VideoImageConverter
+
+
+VIDEO_EXTS = ['.avi', '.mp4', '.mkv', '.mov', '.flv', '.wmv', '.mpg', '.mpeg', '.ts', '.webm']
+# a job whose worker process died, e.g. killed by the OOM killer, is failed
+# after its worker died this many times while it ran alone
+MAX_ATTEMPTS = 2
+
+
+def expand_inputs(inputs, exts=VIDEO_EXTS):
+    '''
+    expand inputs to a sorted list of video files
+
+    inputs: a glob ('videos/**/*.avi' is recursive), a folder (its videos, recursively),
+            a list file ('.txt' or '.lst', one path per line), or a list of them
+    '''
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    filenames = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                filenames += [os.path.join(root, f) for f in files if os.path.splitext(f)[1].lower() in exts]
+        elif os.path.splitext(item)[1].lower() in ['.txt', '.lst'] and os.path.isfile(item):
+            with open(item) as f:
+                # a missing file in a list fails as its own job
+                filenames += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        elif glob.has_magic(item):
+            filenames += [f for f in glob.glob(item, recursive=True) if os.path.isfile(f)]
+        else:
+            filenames.append(item)
+    return sorted(set(filenames))
+
+
+def _run_job(method, args):
+    # module level, so it can be pickled to process workers
+    start = time.time()
+    result = {'input': args[0], 'output': args[1], 'status': 'ok', 'seconds': 0.0, 'error': None}
+    try:
+        if method == 'video2images':
+            VideoImageConverter().video2images(*args[:2], **args[2])
+        else:
+            getattr(VideoProcesser(), method)(*args[:2], **args[2])
+    except Exception:
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.time() - start
+    return result
+
+
+def _get_pool(max_decoders):
+    # workers keep quiet, only the overall progress is shown
+    return ProcessPoolExecutor(max_workers=max_decoders, initializer=set_verbose, initargs=(False,))
+
+
+def run_jobs(method, jobs, max_decoders=4, desc=None):
+    '''
+    run the jobs of a VideoProcesser or VideoImageConverter method on a process pool
+
+    jobs: list of (input, output, kwargs), the larger inputs are run first
+    max_decoders: max jobs decoding at the same time
+    return the result of each job, in the order they are finished.
+    a failed job never stops the others, and its traceback is in its result.
+    when a worker dies, the jobs that were running in the pool are run again one
+    at a time, so only the job that kills its worker alone is charged for it.
+    '''
+    max_decoders = max(1, int(max_decoders))
+    sizes = {job[0]: os.path.getsize(job[0]) if os.path.isfile(job[0]) else 0 for job in jobs}
+    queue = deque(sorted(jobs, key=lambda job: -sizes[job[0]]))
+    # jobs running when a pool broke, any of them may have killed it
+    suspects = deque()
+    attempts = {job[0]: 0 for job in jobs}
+    crashes = {job[0]: 0 for job in jobs}
+    results = []
+    running = {}
+    executor = None
+    pbar = progress(total=sum(sizes.values()), desc=desc or method, unit='B', unit_scale=True)
+    try:
+        while queue or suspects or running:
+            if executor is None:
+                executor = _get_pool(max_decoders)
+            if suspects:
+                # a suspect runs alone, a crash then is its own
+                if not running:
+                    job = suspects.popleft()
+                    attempts[job[0]] += 1
+                    running[executor.submit(_run_job, method, job)] = job
+            else:
+                # only max_decoders jobs are submitted, a broken pool loses no waiting job
+                while queue and len(running) < max_decoders:
+                    job = queue.popleft()
+                    attempts[job[0]] += 1
+                    running[executor.submit(_run_job, method, job)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                # all jobs of a broken pool are lost, the pool is made again
+                done, _ = wait(running)
+                executor.shutdown(wait=False)
+                executor = None
+            lost = [future for future in done if isinstance(future.exception(), BrokenProcessPool)]
+            for future in done:
+                job = running.pop(future)
+                if future in lost:
+                    if len(lost) > 1:
+                        suspects.append(job)
+                        continue
+                    crashes[job[0]] += 1
+                    if crashes[job[0]] < MAX_ATTEMPTS:
+                        suspects.append(job)
+                        continue
+                    result = {'input': job[0], 'output': job[1], 'status': 'failed', 'seconds': 0.0,
+                              'error': 'worker process died {} times'.format(crashes[job[0]])}
+                else:
+                    result = future.result()
+                result['size'] = sizes[job[0]]
+                result['attempts'] = attempts[job[0]]
+                result['crashes'] = crashes[job[0]]
+                results.append(result)
+                pbar.update(sizes[job[0]])
+                if result['status'] != 'ok':
+                    pbar.write('{}: {} failed'.format(method, job[0]))
+    finally:
+        pbar.close()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+class BatchProcesser(object):
+    """
+    batch processer
+
+    Runs video2images, avi2mp4 and crop_video on many videos, with one overall progress bar.
+    Inputs are globs, folders or list files, outputs keep their path relative to the common
+    folder of the inputs. Each job runs on a process pool, see run_jobs.
+    """
+
+    def _output_filenames(self, filenames, outdir, ext=None):
+        # outdir/relative path, ext replaces the file extension, '' drops it
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in filenames])
+        outputs = []
+        for filename in filenames:
+            output = os.path.join(outdir, os.path.relpath(os.path.abspath(filename), root))
+            if ext is not None:
+                output = os.path.splitext(output)[0] + ext
+            outputs.append(output)
+        if len(set(outputs)) < len(outputs):
+            raise ValueError('Some inputs have the same output, as they differ only in the extension.')
+        return outputs
+
+
+    def _run(self, method, inputs, outdir, ext, max_decoders, report, kwargs):
+        filenames = expand_inputs(inputs)
+        if len(filenames) <= 0:
+            log('{}: no video found in {}'.format(method, inputs))
+            return
+        outputs = self._output_filenames(filenames, outdir, ext)
+        for output in outputs:
+            mkdir(os.path.dirname(output))
+        jobs = [(filename, output, kwargs) for filename, output in zip(filenames, outputs)]
+
+        start = time.time()
+        results = run_jobs(method, jobs, max_decoders, 'batch ' + method)
+        seconds = time.time() - start
+        failed = [result for result in results if result['status'] != 'ok']
+        summary = {
+            'method': method,
+            'jobs': len(results),
+            'ok': len(results) - len(failed),
+            'failed': len(failed),
+            'bytes': sum(result['size'] for result in results),
+            'seconds': seconds,
+            'results': sorted(results, key=lambda result: result['input']),
+        }
+
+        log('{}: {} jobs, {} ok, {} failed, {:.1f} MB in {:.1f} seconds'.format(
+            method, summary['jobs'], summary['ok'], summary['failed'], summary['bytes'] / 1e6, seconds))
+        for result in failed:
+            log('  failed: {}\n{}'.format(result['input'], result['error']))
+        if report:
+            mkdir(os.path.dirname(report))
+            with open(report, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+
+    def video2images(self, inputs, outdir='out', max_decoders=4, report=None, **kwargs):
+        '''
+        video2images of each video, to outdir/relative/path/name/
+
+        inputs: glob, folder, list file, or a list of them
+        outdir: output folder
+        max_decoders: max videos decoded at the same time
+        report: json file of the summary and the result of each job
+        kwargs: other options of VideoImageConverter.video2images, like sample_fps or output
+        '''
+        self._run('video2images', inputs, outdir, '', max_decoders, report, kwargs)
+
+
+    def avi2mp4(self, inputs, outdir='out', max_decoders=4, report=None, **kwargs):
+        '''
+        avi2mp4 of each video, to outdir/relative/path/name.mp4
+
+        kwargs: other options of VideoProcesser.avi2mp4, like mode or vcodec
+        see video2images for the others.
+        '''
+        self._run('avi2mp4', inputs, outdir, '.mp4', max_decoders, report, kwargs)
+
+
+    def crop_video(self, inputs, outdir='out', start_time=None, end_time=None, max_decoders=4, report=None, **kwargs):
+        '''
+        crop_video of each video, to outdir/relative/path/name.mp4
+
+        start_time, end_time: see VideoProcesser.crop_video
+        kwargs: other options of VideoProcesser.crop_video, like mode
+        see video2images for the others.
+        '''
+        kwargs.update(start_time=start_time, end_time=end_time)
+        self._run('crop_video', inputs, outdir, '.mp4', max_decoders, report, kwargs)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : ffmpeg_utils.py
+'''
+
+import os
+import re
+import ffmpeg
+import tempfile
+import threading
+import numpy as np
+from queue import Queue
+
+
+# encoders which produce streams that can be concatenated with the source stream
+ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+    'mpeg4': 'mpeg4',
+    'mpeg2video': 'mpeg2video',
+    'mjpeg': 'mjpeg',
+    'vp9': 'libvpx-vp9',
+}
+
+# codecs whose re-encoded boundary GOPs join the copied packets cleanly in a smart crop,
+# other codecs differ in their extradata or lose frames at the joins
+SMART_CODECS = ['h264', 'hevc']
+
+# codecs which can be stored in mp4 as they are
+MP4_CODECS = ['h264', 'hevc', 'mpeg4', 'av1', 'vp9']
+
+
+def parse_rational(value, default=None):
+    '''
+    parse ffprobe rationals like '30000/1001' without eval
+
+    return default if value is missing, malformed or not finite.
+    '''
+    try:
+        num, _, den = str(value).partition('/')
+        result = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return default
+    return result if result > 0 and result != float('inf') else default
+
+
+def probe_video(filename):
+    '''
+    get the first video stream info of filename
+    '''
+    try:
+        probe = ffmpeg.probe(filename, select_streams='v:0')
+    except ffmpeg.Error:
+        raise ValueError('Cannot probe video: {}'.format(filename))
+    if len(probe.get('streams', [])) == 0:
+        raise ValueError('No video stream found in {}.'.format(filename))
+    return probe['streams'][0]
+
+
+def probe_packets(filename):
+    '''
+    list the packets of the first video stream, without decoding
+
+    return the video stream info and its packets sorted by presentation order.
+    '''
+    try:
+        probe = ffmpeg.probe(filename, select_streams='v:0', show_packets=None, show_entries='packet=pts,pts_time,dts,flags,pos')
+    except ffmpeg.Error:
+        raise ValueError('Cannot probe video: {}'.format(filename))
+    if len(probe.get('streams', [])) == 0:
+        raise ValueError('No video stream found in {}.'.format(filename))
+    packets = probe.get('packets', [])
+    # packets are listed in decode order, frame index follows presentation order.
+    # some containers (avi) have no pts, then decode order is presentation order.
+    if all('pts' in p for p in packets):
+        packets = sorted(packets, key=lambda p: p['pts'])
+    return probe['streams'][0], packets
+
+
+def get_keyframes(filename):
+    '''
+    get keyframe indices of the first video stream
+
+    return (keyframes, frame_count), keyframes are 0-based frame indices.
+    '''
+    _, packets = probe_packets(filename)
+    keyframes = [i for i, p in enumerate(packets) if 'K' in p.get('flags', '')]
+    return keyframes, len(packets)
+
+
+def read_scene_frames(filename, threshold=0.4):
+    '''
+    yield (index, frame) of the first frame and the scene changes from one decode
+
+    ffmpeg selects the frames by their scene score and writes them to a pipe,
+    so no frame is decoded twice. frames are BGR, indices are 0-based frame
+    indices computed from the pts of the frames.
+    '''
+    video_info = probe_video(filename)
+    fps = parse_rational(video_info.get('r_frame_rate')) or parse_rational(video_info.get('avg_frame_rate'))
+    if fps is None:
+        raise ValueError('Unknown fps of {}.'.format(filename))
+    start_time = float(video_info.get('start_time', 0) or 0)
+    process = (
+        ffmpeg
+        .input(filename)
+        .video
+        .filter('select', 'eq(n,0)+gt(scene,{})'.format(threshold))
+        # showinfo logs the pts and size of each selected frame before it is written to the pipe
+        .filter('showinfo')
+        .output('pipe:', format='rawvideo', pix_fmt='bgr24', vsync='passthrough')
+        .global_args('-nostats')
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+
+    infos = Queue()
+    def read_infos():
+        for line in process.stderr:
+            for t, width, height in re.findall(rb'Parsed_showinfo.*\bpts_time:\s*(-?[\d.]+).*?\bs:(\d+)x(\d+)', line):
+                infos.put((float(t), int(width), int(height)))
+        infos.put(None)
+    thread = threading.Thread(target=read_infos, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            info = infos.get()
+            if info is None: break
+            t, width, height = info
+            frame = np.empty((height, width, 3), np.uint8)
+            view = memoryview(frame).cast('B')
+            n = 0
+            while n < len(view):
+                size = process.stdout.readinto(view[n:])
+                if not size: break
+                n += size
+            if n < len(view): break
+            yield int(round((t - start_time) * fps)), frame
+    finally:
+        # a generator closed early stops ffmpeg
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        thread.join()
+    if process.returncode not in [0, -9]:
+        raise RuntimeError('Cannot detect scenes of {}.'.format(filename))
+
+
+def concat_videos(part_filenames, filename):
+    '''
+    concat video parts into filename by stream copy
+
+    all parts must have the same codec and size.
+    '''
+    # the concat demuxer reads a list file, paths are quoted in it
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        for part_filename in part_filenames:
+            f.write('file \'{}\'\n'.format(os.path.abspath(part_filename).replace('\'', '\'\\\'\'')))
+        list_filename = f.name
+    try:
+        (
+            ffmpeg
+            .input(list_filename, format='concat', safe=0)
+            .output(filename, c='copy')
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError('Cannot concat videos to {}: {}'.format(filename, e.stderr.decode(errors='ignore')))
+    finally:
+        os.remove(list_filename)
+
+
+def cut_copy(filename, out_filename, start_time, end_time=None, frames=None):
+    '''
+    cut [start_time, end_time) of the video stream without decoding
+
+    the cut starts at the keyframe before start_time, the unit of time is seconds.
+    frames: copy this many packets in decode order instead of cutting at end_time
+    '''
+    input_args = {'ss': start_time} if start_time else {}
+    if frames is not None:
+        output_args = {'vframes': frames}
+    else:
+        output_args = {'t': end_time - (start_time or 0)} if end_time is not None else {}
+    try:
+        (
+            ffmpeg
+            .input(filename, **input_args)
+            .output(out_filename, map='0:v:0', c='copy', copypriorss=1, avoid_negative_ts='make_zero', **output_args)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError('Cannot cut {}: {}'.format(filename, e.stderr.decode(errors='ignore')))
+
+
+def cut_encode(filename, out_filename, start_time, frames, vcodec, **output_args):
+    '''
+    decode from start_time and encode the next frames frames with vcodec
+
+    ffmpeg seeks accurately when transcoding, so the cut is frame-accurate.
+    '''
+    input_args = {'ss': start_time} if start_time > 0 else {}
+    try:
+        (
+            ffmpeg
+            .input(filename, **input_args)
+            .output(out_filename, map='0:v:0', vcodec=vcodec, vframes=frames, **output_args)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError('Cannot encode {}: {}'.format(filename, e.stderr.decode(errors='ignore')))
+
+
+def remux(filename, out_filename, fps=None, codec_name=None):
+    '''
+    copy the video stream into another container without decoding
+
+    fps: rebuild the timestamps at this constant rate, avi may store no pts.
+    codec_name: codec of the stream, mpeg4 from avi may pack B-frames, which are unpacked for mp4
+    '''
+    input_args = {'r': fps} if fps else {}
+    output_args = {'bsf:v': 'mpeg4_unpack_bframes'} if codec_name == 'mpeg4' else {}
+    try:
+        (
+            ffmpeg
+            .input(filename, fflags='+genpts', **input_args)
+            .output(out_filename, map='0:v:0', c='copy', **output_args)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError('Cannot remux {}: {}'.format(filename, e.stderr.decode(errors='ignore')))
+
+
+def transcode(filename, out_filename, vcodec='libx264', preset='medium', threads=0):
+    '''
+    decode and encode the video stream by ffmpeg
+
+    threads: encoder threads, 0 lets ffmpeg choose
+    '''
+    output_args = {'threads': threads}
+    if vcodec in ['libx264', 'libx265']:
+        output_args.update({'preset': preset, 'pix_fmt': 'yuv420p'})
+    try:
+        (
+            ffmpeg
+            .input(filename)
+            # keep every frame as it is, no duplicate or drop for a constant rate
+            .output(out_filename, map='0:v:0', vcodec=vcodec, vsync='passthrough', **output_args)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError('Cannot transcode {}: {}'.format(filename, e.stderr.decode(errors='ignore')))
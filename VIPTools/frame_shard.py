@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : frame_shard.py
+'''
+
+import os
+import cv2
+import json
+import numpy as np
+from collections import deque
+from .utils import mkdir
+from .parallel import _get_executor, map_ordered
+
+
+# frames are stored as jpeg, png, or raw pixels which are read by memmap
+ENCODINGS = ['jpg', 'png', 'raw']
+
+META_FILENAME = 'meta.json'
+INDEX_FILENAME = 'index.bin'
+
+
+def _shard_filename(path, shard):
+    return os.path.join(path, 'shard-{:05d}.bin'.format(shard))
+
+
+def _imencode(ext, frame):
+    rval, buf = cv2.imencode(ext, frame)
+    if not rval:
+        raise ValueError('Cannot encode frame as {}.'.format(ext))
+    return buf
+
+
+def _imdecode(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def is_frame_shard(path):
+    '''
+    whether path is a folder written by FrameShardWriter
+    '''
+    return os.path.isfile(os.path.join(path, META_FILENAME))
+
+
+class FrameShardWriter(object):
+    """
+    frame shard writer
+
+    Frames are appended to a few large shard files instead of one file per frame,
+    and an index records (frame index, shard, offset, length) of each frame.
+    The folder has meta.json, index.bin and shard-xxxxx.bin.
+    """
+
+    def __init__(self, path, encoding='jpg', shard_size=1 << 30, workers=0, worker_type='thread', max_inflight=None, **meta):
+        '''
+        path: folder of the shards, the old shards in it are replaced
+        encoding: 'jpg', 'png' or 'raw', raw frames must have the same shape
+        shard_size: max bytes of a shard
+        workers: number of encode workers, 0 means encode on the caller's thread
+        worker_type: 'thread' or 'process'
+        max_inflight: max frames waiting for encode, defaults to 4 * workers
+        meta: other info saved in meta.json, like fps
+        '''
+        if encoding not in ENCODINGS:
+            raise ValueError('encoding only supports \'jpg\', \'png\' and \'raw\'.')
+        mkdir(path)
+        for filename in os.listdir(path):
+            if filename.startswith('shard-') or filename in [META_FILENAME, INDEX_FILENAME]:
+                os.remove(os.path.join(path, filename))
+        self.path = path
+        self.encoding = encoding
+        self.shard_size = shard_size
+        self.meta = meta
+        self.shape = None
+        self.dtype = None
+        self.count = 0
+        self.shard = -1
+        self.shard_file = None
+        self.offset = 0
+        self.index_file = open(os.path.join(path, INDEX_FILENAME), 'wb')
+
+        # raw frames need no encode
+        workers = int(workers or 0) if encoding != 'raw' else 0
+        self.max_inflight = max(1, int(max_inflight or 4 * workers))
+        self.executor = _get_executor(workers, worker_type) if workers > 0 else None
+        self.pending = deque()
+
+    def write(self, index, frame):
+        '''
+        index: frame index in the video
+        '''
+        if self.shape is None:
+            self.shape, self.dtype = frame.shape, frame.dtype
+        elif self.encoding == 'raw' and (frame.shape != self.shape or frame.dtype != self.dtype):
+            raise ValueError('raw frames must have the same shape: {} != {}.'.format(frame.shape, self.shape))
+
+        if self.encoding == 'raw':
+            self._append(index, np.ascontiguousarray(frame))
+        elif self.executor is None:
+            self._append(index, _imencode('.' + self.encoding, frame))
+        else:
+            # encoded frames are appended in write order
+            while len(self.pending) >= self.max_inflight:
+                self._append(*self._pop())
+            self.pending.append((index, self.executor.submit(_imencode, '.' + self.encoding, frame)))
+
+    def _pop(self):
+        index, future = self.pending.popleft()
+        return index, future.result()
+
+    def _append(self, index, data):
+        data = memoryview(data).cast('B')
+        if self.shard_file is None or (self.offset > 0 and self.offset + len(data) > self.shard_size):
+            if self.shard_file is not None:
+                self.shard_file.close()
+            self.shard += 1
+            self.shard_file = open(_shard_filename(self.path, self.shard), 'wb')
+            self.offset = 0
+        self.shard_file.write(data)
+        self.index_file.write(np.array([index, self.shard, self.offset, len(data)], np.int64).tobytes())
+        self.offset += len(data)
+        self.count += 1
+
+    def close(self, cancel=False):
+        '''
+        cancel: drop the frames waiting for encode, and leave the folder incomplete
+        '''
+        try:
+            if cancel:
+                for _, future in self.pending:
+                    future.cancel()
+                self.pending.clear()
+            while self.pending:
+                self._append(*self._pop())
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+            if self.shard_file is not None:
+                self.shard_file.close()
+            self.index_file.close()
+        # meta.json is written last, a folder without it is incomplete,
+        # as after an error or a cancel
+        if cancel:
+            return
+        meta = dict(self.meta)
+        meta.update({
+            'encoding': self.encoding,
+            'count': self.count,
+            'shards': self.shard + 1,
+            'shape': list(self.shape) if self.shape is not None else None,
+            'dtype': str(self.dtype) if self.dtype is not None else None,
+        })
+        with open(os.path.join(self.path, META_FILENAME), 'w') as f:
+            json.dump(meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+
+class FrameShardReader(object):
+    """
+    frame shard reader
+
+    Random access by position (reader[i]) or by frame index (reader.get(index)),
+    so it can be used as a map-style dataset. Shards are read by memmap, raw frames
+    are read-only views without copy. It can be pickled to dataloader workers.
+    """
+
+    def __init__(self, path):
+        if not is_frame_shard(path):
+            raise ValueError('Not a frame shard folder: {}'.format(path))
+        with open(os.path.join(path, META_FILENAME)) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.encoding = self.meta['encoding']
+        self.shape = tuple(self.meta['shape']) if self.meta['shape'] else None
+        self.dtype = np.dtype(self.meta['dtype']) if self.meta['dtype'] else None
+        # (frame index, shard, offset, length) of each frame
+        self.index = np.fromfile(os.path.join(path, INDEX_FILENAME), np.int64).reshape(-1, 4)
+        self.order = np.argsort(self.index[:, 0], kind='stable')
+        # frame indices in sorted order, searched by get
+        self.sorted_frames = self.index[self.order, 0]
+        self.maps = {}
+
+    def __getstate__(self):
+        # memmaps are opened again in the worker
+        state = self.__dict__.copy()
+        state['maps'] = {}
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def indices(self):
+        # frame indices in position order
+        return self.index[:, 0]
+
+    def _map(self, shard):
+        if shard not in self.maps:
+            self.maps[shard] = np.memmap(_shard_filename(self.path, shard), np.uint8, mode='r')
+        return self.maps[shard]
+
+    def read_bytes(self, position):
+        # the stored bytes of a frame, a memmap view
+        _, shard, offset, length = self.index[position]
+        return self._map(shard)[offset:offset + length]
+
+    def _decode(self, data):
+        if self.encoding == 'raw':
+            return data.view(self.dtype).reshape(self.shape)
+        return _imdecode(data)
+
+    def __getitem__(self, position):
+        return self._decode(self.read_bytes(position))
+
+    def get(self, index):
+        '''
+        get the frame by its frame index in the video, raise KeyError if it is not stored
+        '''
+        i = np.searchsorted(self.sorted_frames, index)
+        if i >= len(self.sorted_frames) or self.sorted_frames[i] != index:
+            raise KeyError(index)
+        return self[self.order[i]]
+
+    def frames(self, workers=0, worker_type='thread', prefetch=None):
+        '''
+        yield frames in position order, decoded ahead on a pool of workers
+
+        workers: number of decode workers, 0 means decode on the caller's thread
+        '''
+        if self.encoding == 'raw':
+            return (self[i] for i in range(len(self)))
+        # bytes are copied out of the memmap only for process workers
+        datas = (self.read_bytes(i) if worker_type == 'thread' else bytes(self.read_bytes(i)) for i in range(len(self)))
+        return map_ordered(_imdecode, datas, workers, worker_type, prefetch)
+
+    def __iter__(self):
+        return self.frames()
+
+    def close(self):
+        self.maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
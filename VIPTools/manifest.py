@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : manifest.py
+'''
+
+import os
+import json
+
+
+def file_identity(filename):
+    '''
+    path, size and mtime of a file, a changed file has another identity
+    '''
+    stat = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def count_files(folder):
+    '''
+    number of files in folder, hidden files like the manifest are not counted
+    '''
+    with os.scandir(folder) as it:
+        return sum(1 for entry in it if not entry.name.startswith('.') and entry.is_file())
+
+
+def output_identity(output):
+    '''
+    identity of an output file, or path and number of files of an output folder
+    '''
+    if os.path.isdir(output):
+        return {'path': os.path.abspath(output), 'files': count_files(output)}
+    return file_identity(output)
+
+
+def output_exists(identity):
+    '''
+    whether the output of an identity is still there: the same file,
+    or a folder with at least as many files
+    '''
+    path = identity.get('path')
+    if 'files' in identity:
+        return os.path.isdir(path) and count_files(path) >= identity['files']
+    return os.path.isfile(path) and file_identity(path) == identity
+
+
+def manifest_filename(output):
+    '''
+    the manifest of an output file is a hidden file beside it,
+    the manifest of an output folder is in it.
+    '''
+    if os.path.isdir(output):
+        return os.path.join(output, '.manifest.json')
+    dirname, basename = os.path.split(output)
+    return os.path.join(dirname, '.{}.manifest.json'.format(basename))
+
+
+class Manifest(object):
+    """
+    job manifest
+
+    Records the source identity, the parameters and the progress of a job.
+    The progress of an older run is loaded only if the source and the
+    parameters are the same, otherwise the job starts again.
+    A job is done only while its recorded output is still there.
+    """
+
+    def __init__(self, filename, source, params):
+        '''
+        filename: manifest filename, see manifest_filename
+        source: source filename
+        params: parameters which change the output, must be json serializable
+        '''
+        self.filename = filename
+        self.source = file_identity(source)
+        # as they are loaded back from json
+        self.params = json.loads(json.dumps(params))
+        self.state = {}
+        if os.path.isfile(filename):
+            try:
+                with open(filename) as f:
+                    data = json.load(f)
+            except ValueError:
+                data = {}
+            if data.get('source') == self.source and data.get('params') == self.params:
+                self.state = data.get('state', {})
+
+    @property
+    def done(self):
+        output = self.state.get('output')
+        return self.state.get('done', False) and output is not None and output_exists(output)
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+    def update(self, **state):
+        self.state.update(state)
+        self.save()
+
+    def save(self):
+        # write and rename, a crash never leaves a broken manifest
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump({'source': self.source, 'params': self.params, 'state': self.state}, f)
+        os.replace(tmp_filename, self.filename)
+
+    def output_done(self, output):
+        '''
+        whether the job is done to output, and the output is not changed
+        or lost files since
+        '''
+        return self.done and self.state['output'].get('path') == os.path.abspath(output)
+
+    def finish_output(self, output, **state):
+        '''
+        mark the job done, output is a file or a folder
+        '''
+        self.update(done=True, output=output_identity(output), **state)
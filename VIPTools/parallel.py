@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : parallel.py
+'''
+
+import os
+import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def _imwrite(filename, frame):
+    # module level, so it can be pickled to process workers
+    return cv2.imwrite(filename, frame)
+
+
+def _imread(filename):
+    return cv2.imread(filename)
+
+
+def _get_executor(workers, worker_type):
+    if worker_type == 'thread':
+        return ThreadPoolExecutor(max_workers=workers)
+    elif worker_type == 'process':
+        return ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError('worker_type only supports \'thread\' and \'process\'.')
+
+
+class ImageWriterPool(object):
+    """
+    image writer pool
+
+    Encode and write images on a pool of thread or process workers.
+    At most max_inflight frames are waiting in the pool, the caller
+    blocks on the oldest one when the pool is full, so memory stays capped.
+    With workers <= 0 the images are written on the caller's thread.
+    """
+
+    def __init__(self, workers=0, worker_type='thread', max_inflight=None):
+        '''
+        workers: number of encode workers, 0 means write inline
+        worker_type: 'thread' or 'process'
+        max_inflight: max frames waiting in the pool, defaults to 4 * workers
+        '''
+        self.workers = int(workers or 0)
+        self.max_inflight = max(1, int(max_inflight or 4 * self.workers))
+        self.executor = _get_executor(self.workers, worker_type) if self.workers > 0 else None
+        self.pending = deque()
+
+    def write(self, filename, frame):
+        if self.executor is None:
+            _imwrite(filename, frame)
+            return
+        # wait for the oldest frame if too many frames are in flight
+        while len(self.pending) >= self.max_inflight:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(_imwrite, filename, frame))
+
+    def flush(self):
+        # wait until every frame written so far is on disk
+        while self.pending:
+            self.pending.popleft().result()
+
+    def close(self, cancel=False):
+        if self.executor is None:
+            return
+        try:
+            if cancel:
+                # drop the waiting frames, the caller is raising already
+                for future in self.pending:
+                    future.cancel()
+                self.pending.clear()
+            # wait all frames, and raise the first error if any
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+
+def map_ordered(func, items, workers=0, worker_type='thread', prefetch=None):
+    '''
+    run func(item) ahead on a pool of workers, and yield the results in order
+
+    workers: number of workers, 0 means run on the caller's thread
+    worker_type: 'thread' or 'process'
+    prefetch: max items run ahead, defaults to 4 * workers
+    '''
+    workers = int(workers or 0)
+    if workers <= 0:
+        for item in items:
+            yield func(item)
+        return
+
+    prefetch = max(1, int(prefetch or 4 * workers))
+    items = iter(items)
+    # the futures are kept in submit order, so the deque is the reorder buffer
+    pending = deque()
+    with _get_executor(workers, worker_type) as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def imread_ordered(filenames, workers=0, worker_type='thread', prefetch=None):
+    '''
+    read images ahead on a pool of workers, and yield them in order
+
+    workers: number of decode workers, 0 means read on the caller's thread
+    worker_type: 'thread' or 'process'
+    prefetch: max images decoded ahead, defaults to 4 * workers
+    '''
+    return map_ordered(_imread, filenames, workers, worker_type, prefetch)
+
+
+def split_segments(keyframes, start_frame, end_frame, segments, frame_count=None):
+    '''
+    split [start_frame, end_frame) into keyframe-aligned segments
+
+    keyframes: sorted 0-based keyframe indices
+    segments: max number of segments
+    frame_count: frames of the video, used when end_frame is None
+    return [(start, end), ...], end of the last segment is end_frame,
+    and None means the end of video.
+    '''
+    stop_frame = end_frame if end_frame is not None else frame_count
+    candidates = [k for k in keyframes if start_frame < k < stop_frame]
+    bounds = [start_frame]
+    for i in range(1, segments):
+        target = start_frame + (stop_frame - start_frame) * i / segments
+        # the nearest keyframe after the last bound
+        candidates = [k for k in candidates if k > bounds[-1]]
+        if not candidates: break
+        bounds.append(min(candidates, key=lambda k: abs(k - target)))
+    return list(zip(bounds, bounds[1:] + [end_frame]))
+
+
+def _open_segment(video_filename, start):
+    video_capture = cv2.VideoCapture(video_filename)
+    if start > 0:
+        video_capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    return video_capture
+
+
+def _segment_frames(video_capture, start, end):
+    c = start
+    while video_capture.isOpened() and (end is None or c < end):
+        rval, frame = video_capture.read()
+        if not rval: break
+        c += 1
+        yield c, frame
+
+
+def _segment_to_images(video_filename, imgdir, start, end):
+    # img index start from 1, as same as the sequential path
+    video_capture = _open_segment(video_filename, start)
+    count = 0
+    try:
+        for c, frame in _segment_frames(video_capture, start, end):
+            cv2.imwrite(os.path.join(imgdir, '{}.jpg'.format(c)), frame)
+            count += 1
+    finally:
+        video_capture.release()
+    return count
+
+
+def _segment_to_video(video_filename, part_filename, type_, fps, size, start, end):
+    video_capture = _open_segment(video_filename, start)
+    video_writer = cv2.VideoWriter(part_filename, cv2.VideoWriter_fourcc(*type_), fps, size)
+    count = 0
+    try:
+        for _, frame in _segment_frames(video_capture, start, end):
+            video_writer.write(frame)
+            count += 1
+    finally:
+        video_capture.release()
+        video_writer.release()
+    return count
+
+
+def run_segments(func, jobs, pbar=None):
+    '''
+    run func(*job) of each segment job on a process pool
+
+    return the result of each job in job order.
+    '''
+    with ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = [executor.submit(func, *job) for job in jobs]
+        results = []
+        for future in futures:
+            results.append(future.result())
+            if pbar is not None:
+                pbar.update(results[-1])
+    return results
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : pipeline.py
+'''
+
+from queue import Queue
+from threading import Thread
+from .video.metrics import get_metrics
+
+
+# put into the queue after the last frame
+_END = object()
+
+
+def read_frames(video_capture, count=None):
+    '''
+    yield frames of a cv2.VideoCapture, and release it at the end
+
+    count: max frames to read, None means read to the end
+    '''
+    try:
+        c = 0
+        while video_capture.isOpened() and (count is None or c < count):
+            rval, frame = video_capture.read()
+            if not rval: break
+            c += 1
+            yield frame
+    finally:
+        video_capture.release()
+
+
+class FramePipeline(object):
+    """
+    reader -> writer pipeline
+
+    Frames are read on the caller's thread and written by a dedicated
+    writer thread through a bounded queue. OpenCV releases the GIL in
+    both read and write, so decode and encode overlap.
+    """
+
+    def __init__(self, video_writer, queue_size=32, pbar=None, metrics=None):
+        '''
+        video_writer: object with write(frame) and release(), like cv2.VideoWriter
+        queue_size: max frames between reader and writer
+        pbar: tqdm bar updated by each written frame
+        metrics: Metrics of the 'encode' time, 'queue_wait' time of the reader, 'queue' occupancy and 'frames'
+        '''
+        self.video_writer = video_writer
+        self.pbar = pbar
+        self.metrics = get_metrics(metrics)
+        self.Q = Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+
+    def update(self):
+        while True:
+            frame = self.Q.get()
+            if frame is _END: break
+            # after an error, keep draining so the reader never blocks on a full queue
+            if self.error is not None: continue
+            try:
+                with self.metrics.timer('encode'):
+                    self.video_writer.write(frame)
+                if self.pbar is not None:
+                    self.pbar.update(1)
+                self.metrics.count('frames')
+                self.metrics.tick()
+            except BaseException as e:
+                self.error = e
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, frame):
+        '''
+        queue a frame for the writer, block while the queue is full.
+        return False if the writer failed, then the frame is dropped.
+        '''
+        if self.error is not None:
+            return False
+        with self.metrics.timer('queue_wait'):
+            self.Q.put(frame)
+        self.metrics.gauge('queue', self.Q.qsize())
+        return True
+
+    def close(self):
+        '''
+        wait for the queued frames, release the writer and raise its error if any
+        '''
+        self.Q.put(_END)
+        self.thread.join()
+        self.video_writer.release()
+        if self.error is not None:
+            raise self.error
+
+    def run(self, frames):
+        '''
+        write all frames, then release both the reader and the writer
+
+        frames: iterable of frames, closed at the end if it is a generator
+        return the number of frames read.
+        '''
+        c = 0
+        self.start()
+        try:
+            for frame in frames:
+                if not self.put(frame): break
+                c += 1
+        finally:
+            if hasattr(frames, 'close'):
+                frames.close()
+            self.close()
+        return c
@@ -6,6 +6,12 @@
 '''
 
 import os
+from tqdm import tqdm
+
+
+# progress bars and messages of the processers, set_verbose(False) or
+# VIPTOOLS_VERBOSE=0 in the environment turns them off, for headless runs
+_verbose = os.environ.get('VIPTOOLS_VERBOSE', '1') != '0'
 
 
 def mkdir(dir_):
@@ -16,3 +22,41 @@ def mkdir(dir_):
     '''
     if dir_ is not None and isinstance(dir_, str) and len(dir_) > 0 and not os.path.exists(dir_):
         os.makedirs(dir_)
+
+
+def list_images(imgdir, ext='.jpg'):
+    '''
+    list images named by index, like '1.jpg', sorted by index
+
+    imgdir: images folder
+    the folder is listed in one os.scandir pass.
+    '''
+    imgs = []
+    with os.scandir(imgdir) as it:
+        for entry in it:
+            if entry.name.endswith(ext) and entry.is_file():
+                imgs.append((int(entry.name[:-len(ext)]), entry.path))
+    imgs.sort()
+    return [path for _, path in imgs]
+
+
+def set_verbose(verbose=True):
+    '''
+    turn progress bars and messages on or off, batch workers turn them off
+    '''
+    global _verbose
+    _verbose = bool(verbose)
+
+
+def progress(total=None, desc=None, verbose=None, **kwargs):
+    '''
+    a tqdm bar, disabled when not verbose
+
+    verbose: True or False of the caller, None follows set_verbose
+    '''
+    return tqdm(total=total, desc=desc, disable=not (_verbose if verbose is None else verbose), **kwargs)
+
+
+def log(*args, verbose=None):
+    if _verbose if verbose is None else verbose:
+        print(*args)
@@ -0,0 +1,295 @@
+'''
+    asyncio versions of VideoCapture and MultiVideoStream.
+    The ffmpeg stdout pipe is read by the event loop, no thread per source.
+'''
+
+import time
+import asyncio
+import numpy as np
+from functools import partial
+
+try:
+    from .video_capture import VideoCapture, _get_clock
+except ImportError:
+    from video_capture import VideoCapture, _get_clock
+
+
+# put into the merge queue when a source is ended
+_END = object()
+
+
+class AsyncVideoCapture(VideoCapture):
+    """
+    VideoCapture read by asyncio subprocess streams
+
+    create it with `await AsyncVideoCapture.open(uri, ...)`, which probes
+    the source off the event loop and starts ffmpeg.
+    """
+    def _ffmpeg_capture(self, uri, out_fps=None, input_args={}, output_args={}):
+        # ffmpeg is started by start() on the event loop
+        self.cap_args = self._ffmpeg_output(uri, out_fps, input_args, output_args).compile()
+        return None
+
+    @classmethod
+    async def open(cls, uri, **capture_args):
+        # the probe is a blocking subprocess call, run it in the default executor
+        loop = asyncio.get_running_loop()
+        cap = await loop.run_in_executor(None, partial(cls, uri, **capture_args))
+        return await cap.start()
+
+    async def start(self):
+        if self.cap_process is None:
+            self.cap_process = await asyncio.create_subprocess_exec(
+                *self.cap_args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL if self.quiet else None,
+                # buffer up to two frames before the pipe is paused
+                limit=max(self.frame_size, 2 ** 16),
+            )
+        return self
+
+    async def read(self, type=None):
+        '''
+            read the next frame, None at the end of stream.
+            numpy frames are writable copies of the pipe bytes, as of VideoCapture.
+        '''
+        type = type or 'bytes'
+        if type not in ['bytes', 'numpy']:
+            raise ValueError('The type option can only be \'bytes\' and \'numpy\'.')
+        if self.stopped:
+            return None
+        if self.cap_process is None:
+            raise RuntimeError('AsyncVideoCapture is not started, call await start() first.')
+        try:
+            # cancelling the wait loses no data, the frame stays in the stream buffer
+            with self.metrics.timer('read'):
+                frame = await self.cap_process.stdout.readexactly(self.frame_size)
+        except asyncio.IncompleteReadError as e:
+            assert len(e.partial) == 0
+            await self.close()
+            return None
+        self.frame_index += 1
+        self._count_frame()
+        if type == 'bytes':
+            return frame
+        # the stream gives immutable bytes, a copy makes the frame writable
+        frame = np.frombuffer(frame, np.uint8).reshape(self.frame_shape).copy()
+        if self.pix_fmt == 'rgb24':
+            frame = frame[:, :, ::-1] # RGB to BGR view
+        return frame
+
+    async def read_batch(self, n, timeout=None, out=None):
+        '''
+            read up to n frames into one contiguous (N, H, W, C) array, as of VideoCapture.read_batch.
+            a timeout leaves the unfinished frame in the stream buffer for the next read.
+        '''
+        if self.pix_fmt == 'rgb24':
+            raise ValueError('read_batch does not support pix_fmt \'rgb24\', use \'bgr24\' to get BGR frames as read() does.')
+        if self.stopped:
+            return None
+        if self.cap_process is None:
+            raise RuntimeError('AsyncVideoCapture is not started, call await start() first.')
+        batch = out if out is not None else np.empty((n,) + self.frame_shape, np.uint8)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        count = 0
+        while count < n:
+            read = self.cap_process.stdout.readexactly(self.frame_size)
+            try:
+                with self.metrics.timer('read'):
+                    if deadline is None:
+                        frame = await read
+                    else:
+                        frame = await asyncio.wait_for(read, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            except asyncio.IncompleteReadError as e:
+                assert len(e.partial) == 0
+                await self.close()
+                break
+            batch[count] = np.frombuffer(frame, np.uint8).reshape(self.frame_shape)
+            self.frame_index += 1
+            self._count_frame()
+            count += 1
+        if count == 0:
+            return None if self.stopped else (None, 0, np.empty(0, np.int64))
+        indices = np.arange(self.frame_index - count, self.frame_index)
+        return batch, count, indices
+
+    def _read_into(self, frame):
+        # the sync pipe reads do not work on an asyncio stream
+        raise TypeError('AsyncVideoCapture reads are coroutines, use await read() or await read_batch().')
+
+    def release(self):
+        if self.is_opened() and self.cap_process is not None and self.cap_process.returncode is None:
+            self.cap_process.terminate()
+        self.stopped = True
+
+    async def close(self, timeout=1.0):
+        # release and wait for ffmpeg to exit
+        self.release()
+        if self.cap_process is None: return
+        try:
+            await asyncio.wait_for(self.cap_process.wait(), timeout)
+        except asyncio.TimeoutError:
+            # ffmpeg is blocked on a full pipe, it never sees the terminate
+            self.cap_process.kill()
+            await self.cap_process.wait()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.read(type='numpy')
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class AsyncMultiVideoStream(object):
+    def __init__(self, source_dicts, quiet=True, read_type='numpy', clock=None, queue_size=32):
+        '''
+            source_dicts: [{'uri': 'xxxx', 'gpu_id': 0}, ...], other keys are passed to AsyncVideoCapture
+            clock: timestamp of each frame, 'pts', 'wall' or None, see VideoStream
+            queue_size: max frames waiting in items()
+        '''
+        self.source_dicts = [dict(source_dict) for source_dict in source_dicts]
+        self.uris = [source_dict['uri'] for source_dict in source_dicts]
+        self.streams_count = len(self.source_dicts)
+        self.quiet = quiet
+        self.read_type = read_type
+        # each source has its own clock, as a mix of files and live sources
+        self.clocks = [_get_clock(source_dict.get('clock', clock), source_dict['uri']) for source_dict in source_dicts]
+        self.queue_size = queue_size
+        self.caps = []
+
+    async def start(self):
+        # open every source at once
+        opens = []
+        for source_dict in self.source_dicts:
+            source_args = dict(source_dict)
+            uri = source_args.pop('uri')
+            source_args.pop('clock', None)
+            source_args.setdefault('quiet', self.quiet)
+            opens.append(AsyncVideoCapture.open(uri, **source_args))
+        caps = await asyncio.gather(*opens, return_exceptions=True)
+        errors = [cap for cap in caps if isinstance(cap, BaseException)]
+        if errors:
+            # no ffmpeg is left running by the sources that opened
+            await asyncio.gather(*[cap.close() for cap in caps if not isinstance(cap, BaseException)])
+            raise errors[0]
+        self.caps = list(caps)
+        return self
+
+    def _timestamp(self, idx, cap, index):
+        if self.clocks[idx] == 'wall' or not cap.fps:
+            return time.time()
+        return float(cap.video_info.get('start_time', 0) or 0) + index / cap.fps
+
+    async def read_item(self, idx):
+        # return next (index, timestamp, frame) of a stream, (None, None, None) at the end of stream
+        assert isinstance(idx, int) and idx >= 0 and idx < self.streams_count, f'Type of var i does not match or i out of range[0:{self.streams_count - 1}]: {idx}'
+        if not self.caps:
+            raise RuntimeError('AsyncMultiVideoStream is not started, call await start() first.')
+        cap = self.caps[idx]
+        frame = await cap.read(type=self.read_type)
+        if frame is None:
+            return (None, None, None)
+        index = cap.frame_index - 1
+        return index, self._timestamp(idx, cap, index), frame
+
+    async def read(self, idx=None):
+        '''
+            read the next frame of a stream, or of every stream at once if idx is None.
+            ended streams give None.
+        '''
+        if idx is not None:
+            return (await self.read_item(idx))[2]
+        items = await asyncio.gather(*[self.read_item(i) for i in range(self.streams_count)])
+        return [item[2] for item in items]
+
+    async def items(self):
+        '''
+            yield (idx, index, timestamp, frame) of every stream as they are decoded,
+            a slow source never holds up the others.
+        '''
+        queue = asyncio.Queue(maxsize=self.queue_size)
+
+        async def feed(idx):
+            try:
+                while True:
+                    index, timestamp, frame = await self.read_item(idx)
+                    if frame is None: break
+                    await queue.put((idx, index, timestamp, frame))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # re-raised in the consumer
+                await queue.put(e)
+                return
+            await queue.put(_END)
+
+        tasks = [asyncio.ensure_future(feed(i)) for i in range(self.streams_count)]
+        ended = 0
+        try:
+            while ended < self.streams_count:
+                item = await queue.get()
+                if item is _END:
+                    ended += 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def running(self):
+        return any(cap.is_opened() for cap in self.caps)
+
+    async def stop(self):
+        await asyncio.gather(*[cap.close() for cap in self.caps])
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frames = await self.read()
+        if all(frame is None for frame in frames):
+            raise StopAsyncIteration
+        return frames
+
+    async def __aenter__(self):
+        if not self.caps:
+            await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+
+if __name__ == '__main__':
+    from tqdm import tqdm
+
+    async def main(source_dicts):
+        pbar = tqdm(desc='frames')
+        async with AsyncMultiVideoStream(source_dicts) as streams:
+            async for idx, index, timestamp, frame in streams.items():
+                # do process
+                pbar.update(1)
+
+    source_dicts = [
+        {
+            'uri': 'your uri',
+            'gpu_id': 0,
+        },
+    ]
+
+    asyncio.run(main(source_dicts))
@@ -0,0 +1,125 @@
+'''
+    A bounded frame queue driven by a condition instead of sleep polling.
+'''
+
+from collections import deque
+from threading import Condition
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+
+# returned by get() when the queue is closed and drained
+EOS = object()
+
+
+# what put() does when the queue is full
+POLICIES = ['block', 'drop_oldest', 'latest']
+
+
+class FrameQueue(object):
+    def __init__(self, maxsize=0, cond=None, policy='block'):
+        '''
+            maxsize: max items in the queue, 0 means unbounded
+            cond: a Condition shared with other queues, so one thread can wait on all of them
+            policy: 'block' waits for room, 'drop_oldest' drops the oldest item as a ring buffer,
+                'latest' keeps only the newest item.
+        '''
+        if policy not in POLICIES:
+            raise ValueError('The policy option can only be \'block\', \'drop_oldest\' and \'latest\'.')
+        self.policy = policy
+        self.maxsize = 1 if policy == 'latest' else maxsize
+        self.items = deque()
+        self.cond = cond or Condition()
+        self.closed = False
+        # items dropped by 'drop_oldest' and 'latest'
+        self.dropped = 0
+
+    def _wait(self, predicate, timeout):
+        # wait until predicate() is True, return False on timeout
+        if timeout is None:
+            self.cond.wait_for(predicate)
+            return True
+        return self.cond.wait_for(predicate, timeout)
+
+    def _full(self):
+        return self.maxsize > 0 and len(self.items) >= self.maxsize
+
+    def put(self, item, block=True, timeout=None):
+        '''
+            put an item, wait while the queue is full.
+            return False if the queue is closed, or if it is still full after timeout.
+        '''
+        with self.cond:
+            if self.policy != 'block':
+                # never wait, make room by dropping the oldest items
+                while not self.closed and self._full():
+                    self.items.popleft()
+                    self.dropped += 1
+            elif block and not self._wait(lambda: self.closed or not self._full(), timeout):
+                return False
+            if self.closed or self._full():
+                return False
+            self.items.append(item)
+            self.cond.notify_all()
+            return True
+
+    def get(self, block=True, timeout=None):
+        '''
+            get an item, wait while the queue is empty.
+            return EOS if the queue is closed and drained, raise Empty on timeout.
+        '''
+        with self.cond:
+            if block and not self._wait(lambda: self.closed or self.items, timeout):
+                raise Empty
+            if self.items:
+                item = self.items.popleft()
+                self.cond.notify_all()
+                return item
+            if self.closed:
+                return EOS
+            raise Empty
+
+    def peek(self, block=True, timeout=None):
+        '''
+            as get(), but the item stays in the queue.
+        '''
+        with self.cond:
+            if block and not self._wait(lambda: self.closed or self.items, timeout):
+                raise Empty
+            if self.items:
+                return self.items[0]
+            if self.closed:
+                return EOS
+            raise Empty
+
+    def wait(self, timeout=None):
+        '''
+            wait until an item is ready or the queue is closed.
+            return True if an item is ready.
+        '''
+        with self.cond:
+            self._wait(lambda: self.closed or self.items, timeout)
+            return len(self.items) > 0
+
+    def close(self, clear=False):
+        '''
+            mark the end of stream and wake up all waiters.
+            the queued items can still be read, unless clear is True.
+        '''
+        with self.cond:
+            self.closed = True
+            if clear:
+                self.items.clear()
+            self.cond.notify_all()
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return len(self.items) == 0
+
+    def full(self):
+        return self._full()
@@ -0,0 +1,196 @@
+'''
+    Random access to frames by index.
+
+    A packet index of the video is built once by ffprobe and saved beside it.
+    A read seeks to the keyframe before the frame and decodes forward only
+    as far as needed, the decoded frames are kept in a LRU cache.
+'''
+
+import os
+import json
+import bisect
+import ffmpeg
+import numpy as np
+from collections import OrderedDict
+
+try:
+    from .video_capture import VideoCapture
+except ImportError:
+    from video_capture import VideoCapture
+
+
+def _build_index(uri):
+    # presentation time of each frame and the keyframe indices, without decoding
+    try:
+        probe = ffmpeg.probe(uri, select_streams='v:0', show_packets=None, show_entries='packet=pts_time,dts_time,flags')
+    except ffmpeg.Error:
+        raise ValueError('URI cannot be connected or incorrect: {}'.format(uri))
+    if len(probe.get('streams', [])) == 0:
+        raise ValueError('No video stream found in {}.'.format(uri))
+    video_info = probe['streams'][0]
+    packets = probe.get('packets', [])
+    # packets are in decode order, frame index follows presentation order
+    if all('pts_time' in p for p in packets):
+        packets = sorted(packets, key=lambda p: float(p['pts_time']))
+        times = np.array([float(p['pts_time']) for p in packets])
+        keyframes = np.array([i for i, p in enumerate(packets) if 'K' in p.get('flags', '')], np.int64)
+    else:
+        # avi with packed B-frames has no pts, a seek cannot be mapped to a frame index,
+        # so frames are decoded forward from the start
+        times = np.zeros(0)
+        keyframes = np.array([0], np.int64)
+    return video_info, times, keyframes, len(packets)
+
+
+class FrameReader(object):
+    """
+    random access frame reader
+
+    reader.get_frame(i) or reader[i] reads a frame, reader.get_frames([i, j, ...])
+    reads many frames and decodes each GOP once. Frames are BGR and read-only,
+    as they are shared with the cache.
+    """
+    def __init__(self, uri, index_path=None, cache_size=64, quiet=True, pix_fmt='bgr24', out_size=None, crop=None):
+        '''
+            index_path: where the packet index is saved, defaults to '{uri}.index.npz',
+                False keeps it in memory only. It is built again if the video is changed.
+            cache_size: max decoded frames in the LRU cache
+            pix_fmt, out_size, crop: see VideoCapture
+        '''
+        self.uri = uri
+        self.cache_size = cache_size
+        self.capture_args = {'quiet': quiet, 'pix_fmt': pix_fmt, 'out_size': out_size, 'crop': crop}
+        self.index_path = uri + '.index.npz' if index_path is None else index_path
+        self._load_index()
+        self.cache = OrderedDict()
+        # the open capture and the index of the next frame it reads
+        self.cap = None
+        self.next_index = None
+
+    def _source_identity(self):
+        if not os.path.isfile(self.uri):
+            return None
+        stat = os.stat(self.uri)
+        return np.array([stat.st_size, stat.st_mtime])
+
+    def _load_index(self):
+        identity = self._source_identity()
+        if self.index_path and identity is not None and os.path.isfile(self.index_path):
+            # video_info is saved as json, a broken or older index is built again
+            try:
+                with np.load(self.index_path, allow_pickle=False) as data:
+                    if np.array_equal(data['identity'], identity):
+                        self.video_info = json.loads(str(data['video_info']))
+                        self.times = data['times']
+                        self.keyframes = data['keyframes']
+                        self.frame_count = int(data['frame_count'])
+                        return
+            except (OSError, ValueError, KeyError):
+                pass
+        self.video_info, self.times, self.keyframes, self.frame_count = _build_index(self.uri)
+        if self.index_path and identity is not None:
+            # the index is only a cache, a read-only folder keeps it in memory
+            try:
+                np.savez(self.index_path, identity=identity, video_info=np.array(json.dumps(self.video_info)),
+                         times=self.times, keyframes=self.keyframes, frame_count=self.frame_count)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return self.frame_count
+
+    def _keyframe(self, index):
+        # the keyframe at or before index
+        i = bisect.bisect_right(self.keyframes, index) - 1
+        return int(self.keyframes[i]) if i >= 0 else 0
+
+    def _seek(self, index):
+        # ffmpeg seeks to the keyframe before, decodes forward and drops the frames before index.
+        # The time is a quarter frame early, so rounding never drops the frame itself.
+        self.release()
+        input_args = {}
+        if len(self.times) == 0:
+            index = 0
+        if index > 0:
+            start_time = float(self.video_info.get('start_time', 0) or 0)
+            interval = self.times[index] - self.times[index - 1]
+            input_args['ss'] = '{:.6f}'.format(max(self.times[index] - start_time - interval / 4, 0))
+        self.cap = VideoCapture(self.uri, buffer_count=0, input_args=input_args, video_info=self.video_info, **self.capture_args)
+        self.next_index = index
+
+    def _cache_put(self, index, frame):
+        frame.flags.writeable = False
+        self.cache[index] = frame
+        self.cache.move_to_end(index)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _decode_group(self, keyframe, indices, frames):
+        # read on from the open capture if it is already in this GOP, or seek
+        if self.cap is None or not (keyframe <= self.next_index <= indices[0]):
+            self._seek(indices[0])
+        wanted = set(indices)
+        while self.next_index <= indices[-1]:
+            frame = self.cap.read(type='numpy')
+            if frame is None:
+                self.release()
+                break
+            index = self.next_index
+            self.next_index += 1
+            self._cache_put(index, frame)
+            if index in wanted:
+                frames[index] = frame
+
+    def get_frames(self, indices):
+        '''
+            read frames by index, in the order of indices.
+            the missing frames are grouped by GOP, and each GOP is decoded once.
+        '''
+        frames = {}
+        missing = []
+        for index in sorted(set(indices)):
+            if index < 0 or index >= self.frame_count:
+                raise IndexError('frame index out of range[0:{}]: {}'.format(self.frame_count - 1, index))
+            if index in self.cache:
+                self.cache.move_to_end(index)
+                frames[index] = self.cache[index]
+            else:
+                missing.append(index)
+
+        groups = OrderedDict()
+        for index in missing:
+            groups.setdefault(self._keyframe(index), []).append(index)
+        for keyframe, group in groups.items():
+            self._decode_group(keyframe, group, frames)
+        return [frames.get(index) for index in indices]
+
+    def get_frame(self, index):
+        return self.get_frames([index])[0]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.frame_count
+        return self.get_frame(index)
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+        self.cap = None
+        self.next_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+if __name__ == '__main__':
+    import time
+
+    uri = 'your uri'
+    reader = FrameReader(uri)
+    start = time.time()
+    frames = reader.get_frames(list(range(0, len(reader), 10)))
+    print('Read %s frames in %0.2f seconds.' % (len(frames), time.time() - start))
+    reader.release()
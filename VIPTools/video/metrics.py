@@ -0,0 +1,263 @@
+'''
+    Per-stage metrics of the pipelines.
+
+    Stage timings go to log2 histograms, and counters (frames, bytes, dropped
+    and late frames) and gauges (queue occupancy) are kept beside them.
+    stats() takes a snapshot, exporters get it every interval seconds,
+    and a log line of it can be printed for headless runs.
+'''
+
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+# bucket i of a histogram counts the values in [2 ** (i - 1), 2 ** i) microseconds
+BUCKETS = 32
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Histogram(object):
+    """
+    log2 histogram of durations in seconds
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * BUCKETS
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.buckets[min(max(int(value * 1e6), 0).bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, q):
+        # the upper bound of the bucket, clipped by the max
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        n = 0
+        for i, c in enumerate(self.buckets):
+            n += c
+            if n >= rank and c:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            # upper bound in seconds: count, of the used buckets
+            'buckets': {'{:g}'.format((1 << i) / 1e6): c for i, c in enumerate(self.buckets) if c},
+        }
+
+
+class JsonLinesExporter(object):
+    """
+    exporter appending each stats snapshot to a json lines file
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self, stats):
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(stats) + '\n')
+
+
+def _log_stderr(line):
+    print(line, file=sys.stderr, flush=True)
+
+
+class Metrics(object):
+    """
+    metrics of one pipeline
+
+    with metrics.timer('encode'): ... times a stage, metrics.timed('decode', frames)
+    times each item of an iterable, metrics.count('frames') and metrics.gauge('queue', n)
+    keep counters and gauges. A disabled Metrics does nothing, so the pipelines are
+    instrumented always and cost nothing by default.
+    Children, like the sources of MultiVideoStream, are exported with their parent.
+    """
+    def __init__(self, name=None, interval=None, exporters=None, log=False, enabled=True):
+        '''
+            name: shown in the stats and the log line
+            interval: seconds between periodic exports, None exports only on export()
+            exporters: callables of the stats dict, like JsonLinesExporter('stats.jsonl')
+            log: print a log line to stderr on each export, or a callable of the line
+        '''
+        self.name = name
+        self.interval = interval
+        self.exporters = list(exporters or [])
+        self.log = _log_stderr if log is True else (log or None)
+        self.enabled = enabled
+        self.parent = None
+        self.children = []
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.monotonic()
+            self.last_export = self.start_time
+            self.stages = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def child(self, name):
+        # a Metrics exported with this one
+        metrics = Metrics(name, enabled=self.enabled)
+        if self.enabled:
+            metrics.parent = self
+            self.children.append(metrics)
+        return metrics
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].add(seconds)
+
+    @contextmanager
+    def _timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timer(self, stage):
+        return self._timer(stage) if self.enabled else _NULL_CONTEXT
+
+    def timed(self, stage, iterable):
+        '''
+            time the wait of each item of iterable as stage, like decoding a frame
+        '''
+        if not self.enabled:
+            return iterable
+        return self._timed(stage, iterable)
+
+    def _timed(self, stage, iterable):
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self.observe(stage, time.perf_counter() - start)
+                yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        # last, max and mean of the sampled values, like a queue size
+        if not self.enabled:
+            return
+        with self.lock:
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                gauge = self.gauges[name] = {'last': value, 'max': value, 'total': 0, 'samples': 0}
+            gauge['last'] = value
+            gauge['max'] = max(gauge['max'], value)
+            gauge['total'] += value
+            gauge['samples'] += 1
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.start_time
+            stats = {
+                'name': self.name,
+                'elapsed': elapsed,
+                'stages': {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+                'counters': dict(self.counters),
+                'gauges': {name: {'last': g['last'], 'max': g['max'], 'mean': g['total'] / g['samples']}
+                           for name, g in self.gauges.items()},
+            }
+        frames = stats['counters'].get('frames')
+        stats['fps'] = frames / elapsed if frames and elapsed > 0 else None
+        if self.children:
+            stats['children'] = [metrics.stats() for metrics in self.children]
+        return stats
+
+    def tick(self):
+        '''
+            export if interval seconds passed since the last export, called by the pipelines
+        '''
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        if root.enabled and root.interval and time.monotonic() - root.last_export >= root.interval:
+            root.export()
+
+    def export(self):
+        # send a snapshot to the exporters and the log
+        if not self.enabled:
+            return
+        self.last_export = time.monotonic()
+        if not self.exporters and self.log is None:
+            return
+        stats = self.stats()
+        for exporter in self.exporters:
+            exporter(stats)
+        if self.log is not None:
+            self.log(format_stats(stats))
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+
+def format_stats(stats):
+    '''
+    one line of a stats snapshot: frames, fps, mean stage timings, queues, dropped and late frames
+    '''
+    parts = ['{}:'.format(stats['name'] or 'metrics'), '{:.1f}s'.format(stats['elapsed'])]
+    counters = stats['counters']
+    if 'frames' in counters:
+        parts.append('{} frames'.format(counters['frames']))
+    if stats.get('fps'):
+        parts.append('{:.1f} fps'.format(stats['fps']))
+    for stage, histogram in stats['stages'].items():
+        parts.append('{} {:.2f}/{:.2f} ms'.format(stage, histogram['mean'] * 1e3, histogram['p99'] * 1e3))
+    for name, gauge in stats['gauges'].items():
+        parts.append('{} {:.1f}/{}'.format(name, gauge['mean'], gauge['max']))
+    for name, value in counters.items():
+        if name != 'frames':
+            parts.append('{} {}'.format(name, value))
+    line = ' '.join(parts)
+    for child in stats.get('children', []):
+        line += '\n  ' + format_stats(child)
+    return line
+
+
+def get_metrics(metrics=None, name=None, log_interval=None):
+    '''
+    the Metrics of a metrics option: a Metrics is used as it is, True makes one,
+    None or False makes a disabled one.
+    log_interval: seconds between log lines of a new Metrics, it makes one as well
+    '''
+    if isinstance(metrics, Metrics):
+        return metrics
+    return Metrics(name, interval=log_interval, log=bool(log_interval), enabled=bool(metrics or log_interval))
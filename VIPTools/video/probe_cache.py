@@ -0,0 +1,116 @@
+'''
+    Cache of ffprobe results, so a source is probed once.
+
+    File sources are keyed by path, size and mtime, a changed file is probed again,
+    and the cache can be saved to a json file. Live sources are never cached, as
+    their stream can change on a reconnect.
+'''
+
+import os
+import json
+import atexit
+import ffmpeg
+import threading
+from collections import OrderedDict
+
+
+def probe_stream(uri, **probe_args):
+    '''
+    probe the first video stream of uri, the format duration is kept in it
+    if the stream has no duration, as mkv and webm.
+    '''
+    try:
+        probe = ffmpeg.probe(uri, **probe_args) # can raise ffmpeg.Error
+    except ffmpeg.Error:
+        raise ValueError('URI cannot be connected or incorrect: {}'.format(uri))
+    video_info = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
+    if video_info is None:
+        raise ValueError('No video stream found in {}.'.format(uri))
+    if 'duration' not in video_info and 'duration' in probe.get('format', {}):
+        video_info['duration'] = probe['format']['duration']
+    return video_info
+
+
+class ProbeCache(object):
+    """
+    probe cache
+
+    cache.probe(uri, **probe_args) returns the video stream info of uri,
+    and probes only when it is not cached. Only file sources are cached.
+    """
+    def __init__(self, filename=None, maxsize=1024):
+        '''
+            filename: json file the file sources are saved to, at exit or by save(),
+                None keeps them in memory only.
+            maxsize: max cached sources, the least recently used is dropped
+        '''
+        self.filename = filename
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.dirty = False
+        if filename and os.path.isfile(filename):
+            try:
+                with open(filename) as f:
+                    self.entries.update(json.load(f))
+            except ValueError:
+                pass
+        if filename:
+            atexit.register(self.save)
+
+    def _key(self, uri, probe_args):
+        # the key of a file changes with the file, None for other sources
+        if not os.path.isfile(uri):
+            return None
+        stat = os.stat(uri)
+        source = ['file', os.path.abspath(uri), stat.st_size, stat.st_mtime]
+        return json.dumps([source, sorted((k, str(v)) for k, v in probe_args.items())])
+
+    def get(self, uri, **probe_args):
+        key = self._key(uri, probe_args)
+        if key is None:
+            return None
+        with self.lock:
+            video_info = self.entries.get(key)
+            if video_info is not None:
+                self.entries.move_to_end(key)
+        return dict(video_info) if video_info is not None else None
+
+    def put(self, uri, video_info, **probe_args):
+        key = self._key(uri, probe_args)
+        if key is None:
+            return
+        with self.lock:
+            self.entries[key] = dict(video_info)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def probe(self, uri, **probe_args):
+        video_info = self.get(uri, **probe_args)
+        if video_info is None:
+            video_info = probe_stream(uri, **probe_args)
+            self.put(uri, video_info, **probe_args)
+        return video_info
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.dirty = True
+
+    def save(self):
+        if not self.filename or not self.dirty:
+            return
+        with self.lock:
+            entries = dict(self.entries)
+            self.dirty = False
+        # write and rename, a crash never leaves a broken cache
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_filename, self.filename)
+
+
+# the cache of VideoCapture by default, in memory only
+PROBE_CACHE = ProbeCache()
@@ -0,0 +1,303 @@
+'''
+    A VideoStream variant that decodes frames into a ring of shared memory slots,
+    so worker processes read them without pickling.
+
+    producer thread: free slot -> decode into the slot -> ready queue (slot, index, timestamp)
+    worker process:  ready queue -> frame view of the slot -> release the slot to the free queue
+'''
+
+import os
+import time
+import numpy as np
+import multiprocessing as mp
+from threading import Thread
+from multiprocessing import shared_memory, resource_tracker
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+try:
+    from .video_capture import VideoCapture, _get_clock
+except ImportError:
+    from video_capture import VideoCapture, _get_clock
+
+
+# owner of a slot, other owners are pids of workers
+FREE = 0
+QUEUED = -1
+
+
+def _pid_alive(pid):
+    # reap the finished children first, a zombie still answers to signal 0
+    mp.active_children()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _shares_tracker(pid):
+    # processes started by multiprocessing use the resource tracker of their parent
+    parent = mp.parent_process()
+    return os.getpid() == pid or (parent is not None and parent.pid == pid)
+
+
+class SharedFrameReader(object):
+    """
+    the worker side of SharedVideoStream, pass it to the worker processes as an argument
+    """
+    def __init__(self, name, shape, pix_fmt, ready_q, free_q, owners, creator_pid):
+        self.name = name
+        self.shape = shape
+        self.pix_fmt = pix_fmt
+        self.ready_q = ready_q
+        self.free_q = free_q
+        self.owners = owners
+        self.creator_pid = creator_pid
+        self.frame_size = int(np.prod(shape))
+        self.shm = None
+        # slot held by the iteration
+        self.slot = None
+        self.ended = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update({'shm': None, 'slot': None})
+        return state
+
+    def attach(self):
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+            if not _shares_tracker(self.creator_pid):
+                # a tracker of its own would unlink the memory when this process exits,
+                # the memory is the stream's, stop does it
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        return self
+
+    def frame(self, slot):
+        # a view of the slot, valid until the slot is released
+        frame = np.ndarray(self.shape, np.uint8, buffer=self.attach().shm.buf, offset=slot * self.frame_size)
+        if self.pix_fmt == 'rgb24':
+            frame = frame[:, :, ::-1] # RGB to BGR view
+        return frame
+
+    def read_item(self, timeout=None):
+        '''
+            take the next frame, raise Empty on timeout.
+            return (slot, index, timestamp, frame), or (None, None, None, None) at the end of stream.
+            the frame is a view of shared memory, call release(slot) when it is done.
+        '''
+        if self.ended:
+            return (None, None, None, None)
+        # taking the item is the claim, no lock or count is left behind by a worker killed
+        # around it. a slot taken but not yet owned is found by the producer, see _reclaim
+        item = self.ready_q.get(timeout=timeout)
+        if item is None:
+            # pass the end of stream to the other workers
+            self.ready_q.put(None)
+            self.ended = True
+            return (None, None, None, None)
+        slot, index, timestamp = item
+        self.owners[slot] = os.getpid()
+        return slot, index, timestamp, self.frame(slot)
+
+    def release(self, slot):
+        # give the slot back to the producer, the frame view must not be used after it
+        self.owners[slot] = FREE
+        self.free_q.put(slot)
+
+    def close(self):
+        if self.slot is not None:
+            self.release(self.slot)
+            self.slot = None
+        if self.shm is not None:
+            try:
+                self.shm.close()
+            except BufferError:
+                # frame views are still alive, the mapping goes with them
+                pass
+            self.shm = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # the slot of the last frame is released when the next one is taken
+        if self.slot is not None:
+            self.release(self.slot)
+            self.slot = None
+        slot, index, timestamp, frame = self.read_item()
+        if frame is None:
+            raise StopIteration
+        self.slot = slot
+        return index, timestamp, frame
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SharedVideoStream:
+    def __init__(self, uri, slots=16, gpu_id=None, quiet=True, pix_fmt='rgb24', clock=None, reclaim_interval=1.0, **capture_args):
+        '''
+            slots: frames in the shared memory ring, the producer waits while every slot is in use
+            clock: timestamp of each frame, 'pts', 'wall' or None, see VideoStream
+            reclaim_interval: seconds between checks for slots held by dead workers
+            capture_args: other VideoCapture options, like out_size, crop, frame_step and low_delay
+        '''
+        self.cap = VideoCapture(uri, gpu_id=gpu_id, quiet=quiet, pix_fmt=pix_fmt, buffer_count=0, **capture_args)
+        self.stopped = False
+        self.clock = _get_clock(clock, uri)
+        self.reclaim_interval = reclaim_interval
+        self.start_time = float(self.cap.video_info.get('start_time', 0) or 0)
+        self.slots = slots
+        # frames taken back from dead workers
+        self.reclaimed = 0
+        # sequence number of each queued slot, the last one taken by a worker, and
+        # slots queued behind it which are not owned yet, see _reclaim
+        self.seq = 0
+        self.queued = {}
+        self.taken_seq = -1
+        self.suspects = set()
+
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * self.cap.frame_size)
+        self.ready_q = mp.Queue()
+        self.free_q = mp.Queue()
+        self.owners = mp.Array('i', [FREE] * slots)
+        self.free_slots = list(range(slots))
+        self.buffers = [np.ndarray(self.cap.frame_shape, np.uint8, buffer=self.shm.buf, offset=i * self.cap.frame_size) for i in range(slots)]
+
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+
+    def reader(self):
+        # a handle for worker processes, pass it when the process is created
+        return SharedFrameReader(self.shm.name, self.cap.frame_shape, self.cap.pix_fmt, self.ready_q, self.free_q, self.owners, os.getpid())
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _timestamp(self, index):
+        if self.clock == 'wall' or not self.cap.fps:
+            return time.time()
+        return self.start_time + index / self.cap.fps
+
+    def _reclaim(self):
+        # slots held by dead workers would never come back
+        for slot in range(self.slots):
+            pid = self.owners[slot]
+            if pid > 0 and not _pid_alive(pid):
+                self.owners[slot] = FREE
+                self.free_slots.append(slot)
+                self.reclaimed += 1
+        # the ready queue is first in first out, so a slot still queued behind a taken one was
+        # taken by a worker which died before it owned the slot. a live worker owns it right
+        # after the take, it is given one more interval
+        for slot, seq in list(self.queued.items()):
+            if self.owners[slot] != QUEUED:
+                self.taken_seq = max(self.taken_seq, seq)
+                del self.queued[slot]
+        orphans = set((slot, seq) for slot, seq in self.queued.items() if seq < self.taken_seq)
+        for slot, seq in orphans & self.suspects:
+            del self.queued[slot]
+            self.owners[slot] = FREE
+            self.free_slots.append(slot)
+            self.reclaimed += 1
+        self.suspects = orphans - self.suspects
+
+    def _get_slot(self):
+        # wait for a free slot, return None once stopped
+        while not self.stopped:
+            if self.free_slots:
+                return self.free_slots.pop()
+            try:
+                return self.free_q.get(timeout=self.reclaim_interval)
+            except Empty:
+                self._reclaim()
+        return None
+
+    def update(self):
+        try:
+            while not self.stopped:
+                slot = self._get_slot()
+                if slot is None: break
+                # decode straight into the slot
+                if self.cap.read(out=self.buffers[slot]) is None:
+                    self.free_slots.append(slot)
+                    break
+                index = self.cap.frame_index - 1
+                # a slot back from the workers was taken with its last sequence number
+                self.taken_seq = max(self.taken_seq, self.queued.pop(slot, -1))
+                self.queued[slot] = self.seq
+                self.owners[slot] = QUEUED
+                self.ready_q.put((slot, index, self._timestamp(index)))
+                self.seq += 1
+        finally:
+            # the end of stream mark, each worker passes it on
+            self.stopped = True
+            self.ready_q.put(None)
+            self.cap.release()
+
+    def running(self):
+        return not self.stopped
+
+    def in_use(self):
+        # slots queued or held by workers
+        return sum(1 for slot in range(self.slots) if self.owners[slot] != FREE)
+
+    def stop(self, timeout=1.0):
+        self.stopped = True
+        if self.thread.ident is not None:
+            self.thread.join(timeout + self.reclaim_interval)
+            if self.thread.is_alive():
+                # the producer is still blocked on the pipe, close the pipe
+                self.cap.release()
+                self.thread.join(timeout)
+        else:
+            self.cap.release()
+        # workers keep their own mapping, the memory is freed when the last one closes it
+        self.buffers = []
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        if self.thread.ident is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == '__main__':
+    from tqdm import tqdm
+    from multiprocessing import Process
+
+    def worker(idx, reader):
+        print('Run worker %s (%s)...' % (idx, os.getpid()))
+        c = 0
+        with reader:
+            for index, timestamp, frame in reader:
+                # do process, frame is only valid in this iteration
+                c += 1
+        print('Worker %s processes %s frames.' % (idx, c))
+
+    uri = 'your uri'
+    stream = SharedVideoStream(uri, slots=16)
+    P = [Process(target=worker, args=(i, stream.reader())) for i in range(4)]
+    for p in P: p.start()
+    stream.start()
+    for p in P: p.join()
+    stream.stop()
+
+    print('All workers done.')
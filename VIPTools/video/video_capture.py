@@ -2,26 +2,127 @@
 
 '''
 
-import sys
+import os
+import time
+import select
 import ffmpeg
 import numpy as np
 
+try:
+    from .probe_cache import PROBE_CACHE, probe_stream
+    from .metrics import get_metrics
+except ImportError:
+    from probe_cache import PROBE_CACHE, probe_stream
+    from metrics import get_metrics
+
+try:
+    from ..ffmpeg_utils import parse_rational
+except ImportError:
+    from VIPTools.ffmpeg_utils import parse_rational
+
+
+# bytes per pixel of each output pixel format, yuv420p is planar
+PIX_FMTS = {'rgb24': 3, 'bgr24': 3, 'gray': 1, 'yuv420p': 1.5}
+
+
+# ffmpeg input options of low delay, for live sources
+LOW_DELAY_ARGS = {
+    'fflags': 'nobuffer',
+    'flags': 'low_delay',
+    'probesize': 32,
+    'analyzeduration': 0,
+}
+
+# input options that ffprobe understands too
+PROBE_ARGS = ['fflags', 'probesize', 'analyzeduration', 'rtsp_transport', 'timeout', 'stimeout']
+
+
+def _get_clock(clock, uri):
+    # the timestamp clock of a stream, None is 'pts' for files and 'wall' for live sources,
+    # as 'pts' is start_time + index / fps, the nominal time of a constant frame rate
+    if clock is None:
+        return 'pts' if os.path.isfile(uri) else 'wall'
+    if clock not in ['pts', 'wall']:
+        raise ValueError('The clock option can only be \'pts\' and \'wall\'.')
+    return clock
+
 
 class VideoCapture:
     """
     VideoCapture with cuda by ffmpeg
     """
-    def __init__(self, uri, gpu_id=None, quiet=False, out_fps=None):
+    def __init__(self, uri, gpu_id=None, quiet=False, out_fps=None, pix_fmt='rgb24', buffer_count=0,
+                 out_size=None, crop=None, frame_step=1, low_delay=False, input_args=None, video_info=None,
+                 source_size=None, source_fps=None, probe_cache=None, metrics=None):
+        '''
+            pix_fmt: 'rgb24', 'bgr24', 'gray' (or 'gray8') or 'yuv420p',
+                bgr24 frames are contiguous and already in OpenCV order,
+                yuv420p frames are planar with shape (height * 3 / 2, width), as OpenCV's I420.
+            buffer_count: numpy frames are read into a pool of this many preallocated buffers,
+                a frame is overwritten buffer_count reads later. 0 allocates a new array per read.
+            out_size: (width, height) of output frames, -1 keeps the aspect ratio.
+            crop: (x, y, width, height) region of the source frame, applied before out_size.
+            frame_step: keep one frame of every frame_step frames, of the out_fps frames if out_fps is given.
+            All of them are done in ffmpeg's filter graph, before frames enter the pipe.
+            low_delay: no input buffering and a small probe, for live sources like rtsp.
+            input_args: other ffmpeg input options, like {'rtsp_transport': 'tcp'}
+            video_info: the video stream info of an earlier probe, then uri is not probed again
+            source_size, source_fps: (width, height) and fps of the source, uri is not probed
+                if source_size is given. fps and frame_count are None without source_fps.
+            probe_cache: ProbeCache of the probes of files, defaults to the in-memory PROBE_CACHE,
+                False probes every time. Live sources are probed on each open.
+            metrics: a Metrics, or True to make one, records the 'read' time of each frame
+                from the pipe, and 'frames' and 'pipe_bytes', see stats()
+        '''
+        pix_fmt = 'gray' if pix_fmt == 'gray8' else pix_fmt
+        if pix_fmt not in PIX_FMTS:
+            raise ValueError('The pix_fmt option can only be \'rgb24\', \'bgr24\', \'gray\' and \'yuv420p\'.')
         self.stopped = False
         self.quiet = quiet
+        self.metrics = get_metrics(metrics, uri)
+        self.pix_fmt = pix_fmt
+        self.frame_step = max(1, int(frame_step or 1))
+        
+        input_args = dict(input_args or {})
+        if low_delay:
+            for key, value in LOW_DELAY_ARGS.items():
+                input_args.setdefault(key, value)
         
-        self.video_info = self._get_video_info(uri)
+        if video_info is None and source_size:
+            video_info = {'width': int(source_size[0]), 'height': int(source_size[1])}
+            if source_fps:
+                video_info['avg_frame_rate'] = str(source_fps)
+        self.video_info = video_info or self._get_video_info(uri, input_args, probe_cache)
         self.width = int(self.video_info['width']) if 'width' in self.video_info.keys() else None
         self.height = int(self.video_info['height']) if 'height' in self.video_info.keys() else None
-        self.fps = eval(self.video_info['avg_frame_rate']) if 'avg_frame_rate' in self.video_info.keys() else None
-        self.frame_count = int(self.video_info['nb_frames']) if 'nb_frames' in self.video_info.keys() else None
+        # live sources may have avg_frame_rate '0/0'
+        self.fps = parse_rational(self.video_info.get('avg_frame_rate')) or parse_rational(self.video_info.get('r_frame_rate'))
+        self.frame_count = self._get_frame_count()
+
+        # the output geometry follows the filters
+        self.source_width, self.source_height = self.width, self.height
+        self.crop = tuple(int(v) for v in crop) if crop else None
+        if self.crop:
+            self.width, self.height = self.crop[2], self.crop[3]
+        self.out_size = self._get_out_size(out_size) if out_size else None
+        if self.out_size:
+            self.width, self.height = self.out_size
+        if self.pix_fmt == 'yuv420p' and (self.width % 2 or self.height % 2):
+            raise ValueError('yuv420p needs even width and height: {}x{}.'.format(self.width, self.height))
+        self.out_fps = out_fps
+        if out_fps:
+            if self.fps and self.frame_count:
+                self.frame_count = int(np.ceil(self.frame_count * out_fps / self.fps))
+            self.fps = out_fps
+        if self.frame_step > 1:
+            self.fps = self.fps / self.frame_step if self.fps else None
+            self.frame_count = -(-self.frame_count // self.frame_step) if self.frame_count else None
+
+        self.buffers = [np.empty(self.frame_shape, np.uint8) for _ in range(buffer_count)]
+        self.buffer_index = 0
+        # index of the next frame read from the pipe
+        self.frame_index = 0
 
-        input_args = {}
         if gpu_id:
             input_args.update({
                 'hwaccel': 'nvdec',
@@ -29,27 +130,146 @@ class VideoCapture:
             })
         self.cap_process = self._ffmpeg_capture(uri, out_fps, input_args)
 
-    def read(self, type=None):
-        type = type or 'bytes'
+    def _get_frame_count(self):
+        # nb_frames is missing in mkv, webm and some avi, estimate it by the duration
+        self.frame_count_estimated = False
+        if str(self.video_info.get('nb_frames', '')).isdigit() and int(self.video_info['nb_frames']) > 0:
+            return int(self.video_info['nb_frames'])
+        duration = parse_rational(self.video_info.get('duration'))
+        if duration and self.fps:
+            self.frame_count_estimated = True
+            return int(round(duration * self.fps))
+        return None
+
+    def _get_out_size(self, out_size):
+        # resolve -1 here, so the frame size is known before the first read
+        width, height = int(out_size[0]), int(out_size[1])
+        if width <= 0 and height <= 0:
+            raise ValueError('out_size needs at least one positive side: {}.'.format(out_size))
+        if width <= 0:
+            width = int(round(height * self.width / self.height))
+        elif height <= 0:
+            height = int(round(width * self.height / self.width))
+        return width, height
+
+    @property
+    def frame_shape(self):
+        if self.pix_fmt == 'gray':
+            return (self.height, self.width)
+        elif self.pix_fmt == 'yuv420p':
+            return (self.height * 3 // 2, self.width)
+        # Note: RGB24 and BGR24 == 3 bytes per pixel.
+        return (self.height, self.width, 3)
+
+    @property
+    def frame_size(self):
+        return int(np.prod(self.frame_shape))
+
+    def read(self, type=None, out=None):
+        '''
+            type: 'bytes' or 'numpy'
+            out: numpy array of frame_shape to read into, like a slot of shared memory
+        '''
+        type = 'numpy' if out is not None else (type or 'bytes')
         if type not in ['bytes', 'numpy']:
             raise ValueError('The type option can only be \'bytes\' and \'numpy\'.')
 
-        # Note: RGB24 == 3 bytes per pixel.
-        frame_size = self.width * self.height * 3
-        frame_bytes = self.cap_process.stdout.read(frame_size)
-        if len(frame_bytes) == 0:
+        if type == 'bytes':
+            with self.metrics.timer('read'):
+                frame = self.cap_process.stdout.read(self.frame_size)
+            if len(frame) == 0:
+                self.release()
+                return None
+            assert len(frame) == self.frame_size
+            self.frame_index += 1
+            self._count_frame()
+            return frame
+
+        # read straight into a writable numpy buffer, no intermediate bytes
+        if out is not None:
+            frame = out
+        elif self.buffers:
+            frame = self.buffers[self.buffer_index]
+            self.buffer_index = (self.buffer_index + 1) % len(self.buffers)
+        else:
+            frame = np.empty(self.frame_shape, np.uint8)
+        if not self._read_into(frame):
             self.release()
             return None
+        if self.pix_fmt == 'rgb24':
+            frame = frame[:, :, ::-1] # RGB to BGR view
+        return frame
 
-        assert len(frame_bytes) == frame_size        
+    def read_batch(self, n, timeout=None, out=None):
+        '''
+            read up to n frames straight from the pipe into one contiguous (N, H, W, C) array.
+            channels are in pix_fmt order, so rgb24 is refused, as read() gives BGR views of it.
+            open the capture with pix_fmt='bgr24' for BGR batches.
 
-        if type == 'bytes':
-            frame = frame_bytes
-        elif type == 'numpy':
-            frame = np.frombuffer(frame_bytes, np.uint8).reshape([self.height, self.width, 3])[:, :, ::-1] # RGB format
-        else:
-            raise ValueError('The type option can only be \'bytes\' and \'numpy\'.')
-        return frame
+            timeout: seconds to wait for the batch, None waits until n frames or the end of stream
+            out: preallocated array to fill, a new one is allocated if None
+            return (batch, count, indices), only batch[:count] is valid and indices are their frame indices,
+            (None, 0, empty indices) if no frame came before the timeout, or None if the stream is ended.
+        '''
+        if self.pix_fmt == 'rgb24':
+            raise ValueError('read_batch does not support pix_fmt \'rgb24\', use \'bgr24\' to get BGR frames as read() does.')
+        if self.stopped:
+            return None
+        batch = out if out is not None else np.empty((n,) + self.frame_shape, np.uint8)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        count = 0
+        while count < n:
+            if deadline is not None and not self._wait_readable(deadline - time.monotonic()):
+                break
+            if not self._read_into(batch[count]):
+                self.release()
+                break
+            count += 1
+        if count == 0:
+            # as VideoStream.read_batch, tell the end of stream from a timeout
+            return None if self.stopped else (None, 0, np.empty(0, np.int64))
+        indices = np.arange(self.frame_index - count, self.frame_index)
+        return batch, count, indices
+
+    def _wait_readable(self, timeout):
+        # select sees only the pipe, bytes left in the python buffer by an earlier read
+        # are looked at first, by a peek which cannot block
+        stdout = self.cap_process.stdout
+        if hasattr(stdout, 'peek'):
+            os.set_blocking(stdout.fileno(), False)
+            try:
+                if len(stdout.peek(1)) > 0:
+                    return True
+            finally:
+                os.set_blocking(stdout.fileno(), True)
+        readable, _, _ = select.select([stdout], [], [], max(timeout, 0))
+        return len(readable) > 0
+
+    def _read_into(self, frame):
+        # return False at the end of stream
+        view = memoryview(frame).cast('B')
+        n = 0
+        with self.metrics.timer('read'):
+            while n < len(view):
+                size = self.cap_process.stdout.readinto(view[n:])
+                if not size: break
+                n += size
+        if n == 0:
+            return False
+        assert n == len(view)
+        self.frame_index += 1
+        self._count_frame()
+        return True
+
+    def _count_frame(self):
+        if self.metrics.enabled:
+            self.metrics.count('frames')
+            self.metrics.count('pipe_bytes', self.frame_size)
+            self.metrics.tick()
+
+    def stats(self):
+        # see Metrics.stats
+        return self.metrics.stats()
 
     def is_opened(self):
         return not self.stopped
@@ -60,25 +280,34 @@ class VideoCapture:
         self.stopped = True
 
     def _ffmpeg_capture(self, uri, out_fps=None, input_args={}, output_args={}):
+        return self._ffmpeg_output(uri, out_fps, input_args, output_args).run_async(pipe_stdout=True, quiet=self.quiet)
+
+    def _ffmpeg_output(self, uri, out_fps=None, input_args={}, output_args={}):
+        # the ffmpeg command writing raw frames to stdout
         stream = ffmpeg.input(uri, **input_args)
+        output_args = dict(output_args)
+        # crop and drop frames first, so less frames are scaled
+        if self.crop:
+            x, y, width, height = self.crop
+            stream = stream.filter('crop', width, height, x, y)
+        # fps resamples first and select steps over its frames, as fps and frame_count
+        # are out_fps / frame_step, fps after select would fill the gaps by duplicates
         if out_fps:
             stream = stream.filter('fps', fps=out_fps, round='up')
-        process = (
-            stream
-            .output('pipe:', format='rawvideo', pix_fmt='rgb24')
-            .run_async(pipe_stdout=True, quiet=self.quiet)
-        )
-        return process
-
-    def _get_video_info(self, uri):
-        try:
-            probe = ffmpeg.probe(uri) # can raise ffmpeg.Error
-        except ffmpeg.Error as e:
-            raise ValueError('URI cannot be connected or incorrect: {}'.format(uri))
-        video_info = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
-        if video_info is None:
-            raise ValueError('No video stream found in {}.'.format(uri), file=sys.stderr)
-        return video_info
+        if self.frame_step > 1:
+            stream = stream.filter('select', 'not(mod(n,{}))'.format(self.frame_step))
+            # pass the selected frames as they are, no duplicate to fill the gaps
+            output_args.setdefault('vsync', 'passthrough')
+        if self.out_size:
+            stream = stream.filter('scale', self.out_size[0], self.out_size[1])
+        return stream.output('pipe:', format='rawvideo', pix_fmt=self.pix_fmt, **output_args)
+
+    def _get_video_info(self, uri, input_args={}, probe_cache=None):
+        # probe with the same input options, a small probe opens live sources faster
+        probe_args = {key: value for key, value in input_args.items() if key in PROBE_ARGS}
+        if probe_cache is False:
+            return probe_stream(uri, **probe_args)
+        return (probe_cache or PROBE_CACHE).probe(uri, **probe_args)
 
 
 if __name__ == '__main__':
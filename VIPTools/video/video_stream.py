@@ -7,56 +7,123 @@
 import sys
 import time
 import warnings
-from threading import Thread
+import numpy as np
+from threading import Thread, Condition
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-# import the Queue class from Python 3
+# import the Empty exception from Python 3
 if sys.version_info >= (3, 0):
-    from queue import Queue
-# otherwise, import the Queue class for Python 2.7
+    from queue import Empty
+# otherwise, import the Empty exception for Python 2.7
 else:
-    from Queue import Queue
+    from Queue import Empty
 
 try:
-    from .video_capture import VideoCapture
-except ModuleNotFoundError:
-    from video_capture import VideoCapture
+    from .video_capture import VideoCapture, _get_clock
+    from .frame_queue import FrameQueue, EOS
+    from .metrics import get_metrics
+except ImportError:
+    from video_capture import VideoCapture, _get_clock
+    from frame_queue import FrameQueue, EOS
+    from metrics import get_metrics
+
+
+def _read_batch(read_item, n, timeout=None):
+    # fill one preallocated batch from read_item(timeout) -> (index, timestamp, frame)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    batch, indices, ended = None, [], False
+    while len(indices) < n:
+        try:
+            index, _, frame = read_item(None if deadline is None else max(deadline - time.monotonic(), 0))
+        except Empty:
+            break
+        if frame is None:
+            ended = True
+            break
+        if batch is None:
+            batch = np.empty((n,) + frame.shape, frame.dtype)
+        batch[len(indices)] = frame
+        indices.append(index)
+    if batch is None:
+        # nothing was read, tell the end of stream from a timeout
+        return None if ended else (None, 0, np.empty(0, np.int64))
+    return batch, len(indices), np.array(indices, np.int64)
 
 
 class VideoStream:
-    def __init__(self, uri, transform=None, queue_size=128, gpu_id=None, quiet=True, read_type='numpy'):
+    def __init__(self, uri, transform=None, queue_size=128, gpu_id=None, quiet=True, read_type='numpy', pix_fmt='rgb24',
+                 clock=None, cond=None, policy='block', transform_workers=0, transform_type='thread',
+                 transform_queue_size=None, metrics=None, **capture_args):
+        '''
+            transform_workers: run transform on a pool of this many workers, frames still come out
+                in decode order. 0 runs it on the producer thread.
+            transform_type: 'thread' for transforms which release the GIL (most OpenCV calls),
+                'process' for python-heavy ones, then transform and frames must be picklable.
+            transform_queue_size: max frames in the pool, defaults to 2 * transform_workers.
+                queue_size is the max transformed frames waiting for the consumer.
+            policy: when the queue is full, 'block' waits for the consumer, 'drop_oldest' drops
+                the oldest frame as a ring buffer, 'latest' keeps only the newest frame.
+                Dropping bounds the staleness of live sources, see dropped.
+            capture_args may have low_delay=True for live sources, see VideoCapture.
+            clock: timestamp of each frame, 'pts' is start_time + index / fps, the presentation time
+                in a video of constant frame rate, 'wall' is the time.time() when the frame left the decoder.
+                None is 'pts' for files and 'wall' for live sources.
+            cond: a Condition shared with other streams' queues
+            metrics: a Metrics, or True to make one. Besides the capture's, it records the
+                'transform' and 'queue_wait' times, the 'queue' occupancy and 'dropped' frames, see stats()
+            capture_args: other VideoCapture options, like out_size, crop, frame_step and out_fps
+        '''
+        if transform_type not in ['thread', 'process']:
+            raise ValueError('The transform_type option can only be \'thread\' and \'process\'.')
         # initialize the video capture along with the boolean
-        # used to indicate if the thread should be stopped or not
-        self.cap = VideoCapture(uri, gpu_id=gpu_id, quiet=quiet)
+        # used to indicate if the thread should be stopped or not.
+        # frames wait in the queue, so each read needs its own buffer
+        self.metrics = get_metrics(metrics, uri)
+        self.cap = VideoCapture(uri, gpu_id=gpu_id, quiet=quiet, pix_fmt=pix_fmt, buffer_count=0, metrics=self.metrics, **capture_args)
         self.stopped = False
+        # the consumer got the end of stream
+        self.ended = False
         self.transform = transform
         self.read_type = read_type
+        self.clock = _get_clock(clock, uri)
+        self.start_time = float(self.cap.video_info.get('start_time', 0) or 0)
 
         # initialize queue and thread
-        self.Q = Queue(maxsize=queue_size)
+        self.Q = FrameQueue(maxsize=queue_size, cond=cond, policy=policy)
         self.thread = Thread(target=self.update, args=())
         self.thread.daemon = True
 
+        # decode -> pending futures -> reorder -> queue
+        self.error = None
+        self.executor = None
+        self.pending = None
+        if transform and transform_workers > 0:
+            executor_class = ThreadPoolExecutor if transform_type == 'thread' else ProcessPoolExecutor
+            self.executor = executor_class(max_workers=transform_workers)
+            self.pending = FrameQueue(maxsize=transform_queue_size or 2 * transform_workers)
+            self.transform_thread = Thread(target=self.collect, args=())
+            self.transform_thread.daemon = True
+
     def start(self):
         # start a thread to read frames from the file video stream
+        if self.pending is not None:
+            self.transform_thread.start()
         self.thread.start()
         return self
 
     def update(self):
-        # keep looping infinitely
-        while True:
-            # if the thread indicator variable is set, stop the thread
-            if self.stopped: break
-
-            # otherwise, ensure the queue has room in it
-            if not self.Q.full():
+        try:
+            # keep looping until stop() or the end of the video file
+            while not self.stopped:
                 # read the next frame from the file
                 frame = self.cap.read(type=self.read_type)
 
                 # if the `grabbed` boolean is `False`, then we have
                 # reached the end of the video file
-                if frame is None:
-                    self.stopped = True
-                    
+                if frame is None: break
+                index = self.cap.frame_index - 1
+                timestamp = self._timestamp(index)
+
                 # if there are transforms to be done, might as well
                 # do them on producer thread before handing back to
                 # consumer thread. ie. Usually the producer is so far
@@ -69,112 +136,238 @@ class VideoStream:
                 # native threads and overheads of additional
                 # producer/consumer queues since this one was generally
                 # idle grabbing frames.
+                #
+                # Heavier transforms go to the pool, the producer only
+                # submits them and keeps reading.
+                if self.pending is not None:
+                    future = self.executor.submit(self.transform, frame)
+                    if not self.pending.put((index, timestamp, future)): break
+                    continue
                 if self.transform:
-                    frame = self.transform(frame)
+                    with self.metrics.timer('transform'):
+                        frame = self.transform(frame)
 
-                # add the frame to the queue
-                self.Q.put(frame)
+                # add the frame, its index and timestamp to the queue, block
+                # while the queue is full. It fails once stop() closed the queue.
+                if not self._put((index, timestamp, frame)): break
+        except BaseException as e:
+            self.error = e
+        finally:
+            # the end of stream mark for the consumer
+            self.stopped = True
+            if self.pending is not None:
+                # collect() closes the queue after the pending frames
+                self.pending.close()
             else:
-                time.sleep(0.1)  # Rest for 10ms, we have a full queue
-        self.cap.release()
+                self.Q.close()
+            self.cap.release()
+
+    def collect(self):
+        # the reorder stage, futures are taken in decode order whatever order they finish in
+        try:
+            while True:
+                item = self.pending.get()
+                if item is EOS: break
+                index, timestamp, future = item
+                with self.metrics.timer('transform'):
+                    frame = future.result()
+                if not self._put((index, timestamp, frame)): break
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.pending.close(clear=True)
+            self.Q.close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _put(self, item):
+        if not self.metrics.enabled:
+            return self.Q.put(item)
+        dropped = self.Q.dropped
+        with self.metrics.timer('queue_wait'):
+            rval = self.Q.put(item)
+        self.metrics.gauge('queue', self.Q.qsize())
+        if self.Q.dropped > dropped:
+            self.metrics.count('dropped', self.Q.dropped - dropped)
+        return rval
+
+    @property
+    def dropped(self):
+        # frames dropped by the queue policy
+        return self.Q.dropped
+
+    def stats(self):
+        # see Metrics.stats
+        return self.metrics.stats()
+
+    def _timestamp(self, index):
+        if self.clock == 'wall' or not self.cap.fps:
+            return time.time()
+        return self.start_time + index / self.cap.fps
 
     def read(self):
         # return next frame in the queue
-        return self.Q.get()
+        return self.read_item()[2]
+
+    def read_item(self, timeout=None):
+        # return next (index, timestamp, frame) in the queue, (None, None, None) at the end of stream
+        if self.ended:
+            return (None, None, None)
+        item = self.Q.get(timeout=timeout)
+        if item is EOS:
+            self.ended = True
+            if self.error is not None:
+                # a failed decode or transform ends the stream
+                raise self.error
+            return (None, None, None)
+        return item
+
+    def peek_item(self, timeout=None):
+        # as read_item(), but the item stays in the queue
+        if self.ended:
+            return (None, None, None)
+        item = self.Q.peek(timeout=timeout)
+        if item is EOS:
+            return (None, None, None)
+        return item
+
+    def read_batch(self, n, timeout=None):
+        '''
+            read up to n frames into one contiguous (N, ...) array
+
+            timeout: seconds to wait for the batch, None waits until n frames or the end of stream
+            return (batch, count, indices), only batch[:count] is valid,
+            (None, 0, empty indices) if no frame came before the timeout, or None if the stream is ended.
+        '''
+        return _read_batch(self.read_item, n, timeout)
 
     # Insufficient to have consumer use while(more()) which does
     # not take into account if the producer has reached end of stream.
     def running(self):
         return self.more() or not self.stopped
 
-    def more(self):
-        # return True if there are still frames in the queue. If stream is not stopped, try to wait a moment
-        tries = 0
-        while self.Q.qsize() == 0 and not self.stopped and tries < 5:
-            time.sleep(0.1)
-            tries += 1
-        return self.Q.qsize() > 0
-
-    def stop(self):
-        # wait until stream resources are released (producer thread might be still grabbing frame)
-        self.thread.join()
-        # indicate that the thread should be stopped
+    def more(self, timeout=None):
+        # return True if there are still frames in the queue. If stream is not stopped,
+        # wait until the next frame or the end of stream.
+        return self.Q.wait(timeout)
+
+    def stop(self, timeout=1.0):
+        # indicate that the thread should be stopped, and wake it up
+        # if it is blocked on a full queue
         self.stopped = True
+        self.Q.close(clear=True)
+        if self.pending is not None:
+            self.pending.close(clear=True)
+        if self.thread.ident is None:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+            return
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            # the producer is still blocked on the pipe, close the pipe
+            self.cap.release()
+            self.thread.join(timeout)
+        if self.pending is not None:
+            self.transform_thread.join(timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        frame = self.read()
+        if frame is None:
+            raise StopIteration
+        return frame
+
+    def __enter__(self):
+        if self.thread.ident is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
 
 
 class MultiVideoStream(object):
-    def __init__(self, source_dicts, transform=None, queue_size=32, quiet=True, read_type='numpy'):
+    def __init__(self, source_dicts, transform=None, queue_size=32, quiet=True, read_type='numpy', clock=None, tolerance=None, policy='block',
+                 transform_workers=0, transform_type='thread', transform_queue_size=None, metrics=None):
         '''
-            source_dicts: [{'uri': 'xxxx', 'gpu_id': 0}, ...]
+            transform_workers, transform_type, transform_queue_size: transform pool of each source, see VideoStream
+            source_dicts: [{'uri': 'xxxx', 'gpu_id': 0}, ...], other keys are passed to VideoStream,
+                like {'uri': 'rtsp://xxxx', 'policy': 'latest', 'low_delay': True}
+            policy: queue policy of the sources without their own, see VideoStream
+            clock: timestamp used by read_sync, 'pts', 'wall' or None, see VideoStream
+            tolerance: max timestamp difference of frames in one read_sync set,
+                defaults to half of the shortest frame interval
+            metrics: a Metrics, or True to make one, each source records to its child Metrics,
+                with the frames dropped by read_sync as 'sync_dropped' and its missing frames as 'late'
         '''
         super(MultiVideoStream, self).__init__()
-        # initialize the video capture along with the boolean
-        # used to indicate if the thread should be stopped or not
+        # each source feeds its own queue on its own thread, so a stalled
+        # source never holds up the others. The queues share one condition,
+        # so a reader can wait on all of them.
+        self.cond = Condition()
+        self.metrics = get_metrics(metrics, 'MultiVideoStream')
         self.streams = []
         for source_dict in source_dicts:
-            stream = VideoStream(source_dict['uri'], gpu_id=source_dict['gpu_id'], read_type='numpy').start()
-            if not stream.running():
-                raise ValueError('Cannot open capture: {}.'.format(source_dict['uri']))
+            source_args = dict(source_dict)
+            uri = source_args.pop('uri')
+            source_args.setdefault('transform', transform)
+            source_args.setdefault('queue_size', queue_size)
+            source_args.setdefault('quiet', quiet)
+            source_args.setdefault('read_type', read_type)
+            source_args.setdefault('clock', clock)
+            source_args.setdefault('policy', policy)
+            source_args.setdefault('transform_workers', transform_workers)
+            source_args.setdefault('transform_type', transform_type)
+            source_args.setdefault('transform_queue_size', transform_queue_size)
+            if self.metrics.enabled:
+                source_args.setdefault('metrics', self.metrics.child(uri))
+            stream = VideoStream(uri, cond=self.cond, **source_args)
             self.streams.append(stream)
         self.streams_count = len(self.streams)
-        
-        self.streams_stopped = [False] * len(self.streams)
-        self.stopped = False
-
-        self.transform = transform
-        self.read_type = read_type
-
-        # initialize queue and thread
-
-        self.Qs = [Queue(maxsize=queue_size) for _ in range(self.streams_count)]
-        self.thread = Thread(target=self.update, args=())
-        self.thread.daemon = True
+        self.uris = [source_dict['uri'] for source_dict in source_dicts]
+        self.Qs = [stream.Q for stream in self.streams]
+        # frames dropped by read_sync to catch up with other sources
+        self.sync_dropped = [0] * self.streams_count
+
+        if tolerance is None:
+            fps = max([stream.cap.fps for stream in self.streams if stream.cap.fps] or [25])
+            tolerance = 0.5 / fps
+        self.tolerance = tolerance
+
+    @property
+    def dropped(self):
+        # frames dropped by the queue policy of each source
+        return [stream.dropped for stream in self.streams]
+
+    def stats(self):
+        # the stats of each source are in 'children', see Metrics.stats
+        return self.metrics.stats()
+
+    @property
+    def streams_stopped(self):
+        return [stream.stopped for stream in self.streams]
+
+    @property
+    def stopped(self):
+        return all(self.streams_stopped)
+
+    def start(self, timeout=0.5):
+        '''
+            start a thread per source to read frames from the video streams
 
-    def start(self):
-        # start a thread to read frames from the file video stream
-        self.thread.start()
+            timeout: seconds to wait for the first frame or the end of each source, a source
+                which fails to open ends at once, a stalled one never holds up the others
+        '''
+        for stream in self.streams:
+            stream.start()
+        with self.cond:
+            self.cond.wait_for(lambda: all(stream.Q.qsize() > 0 or stream.Q.closed for stream in self.streams), timeout)
+        for stream, uri in zip(self.streams, self.uris):
+            if stream.error is not None or (stream.stopped and stream.Q.qsize() == 0):
+                raise ValueError('Cannot open capture: {}.'.format(uri))
         return self
 
-    def update(self):
-        # keep looping infinitely
-        while True:
-            # if the thread indicator variable is set, stop the thread
-            if self.stopped: break
-            for i, q in enumerate(self.Qs):
-                # if the thread indicator variable is set, stop the thread
-                if self.stopped: break
-                # if the stream stopped, skip the stream
-                if self.streams_stopped[i]: continue
-                # otherwise, ensure the queue has room in it
-                if not q.full():
-                    frame = self.streams[i].read()
-                    # if we have reached the end of the source, close the source
-                    if frame is None:
-                        self.streams_stopped[i] = True
-                        self.streams[i].stop()
-                        # if all stream are stopped, close the thread
-                        if all(self.streams_stopped):
-                            self.stopped = True
-                    # if there are transforms to be done, might as well
-                    # do them on producer thread before handing back to
-                    # consumer thread. ie. Usually the producer is so far
-                    # ahead of consumer that we have time to spare.
-                    #
-                    # Python is not parallel but the transform operations
-                    # are usually OpenCV native so release the GIL.
-                    #
-                    # Really just trying to avoid spinning up additional
-                    # native threads and overheads of additional
-                    # producer/consumer queues since this one was generally
-                    # idle grabbing frames.
-                    if self.transform:
-                        frame = self.transform(frame)
-                    # add the frame to the queue
-                    q.put(frame)
-            # all queues are full, sleep some time
-            if all(q.full() for q in self.Qs):
-                time.sleep(0.1)
-
     def read(self, idx=None):
         if idx is not None:
             assert isinstance(idx, int) and idx >= 0 and idx < self.streams_count, f'Type of var i does not match or i out of range[0:{self.streams_count - 1}]: {idx}'
@@ -182,10 +375,83 @@ class MultiVideoStream(object):
                 warnings.warn(f'the stream was stopped: {idx}')
                 return None
             # return next frame in the queue
-            return self.Qs[idx].get()
+            return self.streams[idx].read()
         else:
-            # all queue return one frame
-            return [(self.Qs[i].get() if not self.streams_stopped[i] else None) for i in range(self.streams_count)] if not self.stopped else None
+            # all queue return one frame, use read_sync to match them by timestamp
+            return [(self.streams[i].read() if not self.streams_stopped[i] or self.Qs[i].qsize() > 0 else None) for i in range(self.streams_count)] if not self.stopped or self.more() else None
+
+    def read_sync(self, tolerance=None, late='pad', timeout=None):
+        '''
+            read one frame per source, matched by timestamp
+
+            tolerance: max timestamp difference to the set's timestamp, defaults to self.tolerance
+            late: a source without a matching frame before timeout, or an ended source,
+                'pad' gives None in its place, 'skip' leaves it out.
+            timeout: seconds to wait for late sources, None waits for them
+            return (timestamp, frames), frames is a list with 'pad' or a {idx: frame} dict with 'skip',
+            or None if all streams are ended.
+        '''
+        if late not in ['pad', 'skip']:
+            raise ValueError('The late option can only be \'pad\' and \'skip\'.')
+        tolerance = self.tolerance if tolerance is None else tolerance
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        def peek(i):
+            try:
+                return self.streams[i].peek_item(None if deadline is None else max(deadline - time.monotonic(), 0))
+            except Empty:
+                return (None, None, None)
+
+        while True:
+            heads = [peek(i) for i in range(self.streams_count)]
+            timestamps = [head[1] for head in heads if head[2] is not None]
+            if not timestamps:
+                if all(stream.ended or (stream.stopped and stream.Q.qsize() == 0) for stream in self.streams):
+                    return None
+                break
+            # the latest head is the target, older frames of other sources are dropped
+            target = max(timestamps)
+            ahead = False
+            for i in range(self.streams_count):
+                while heads[i][2] is not None and heads[i][1] < target - tolerance:
+                    self.streams[i].read_item()
+                    self.sync_dropped[i] += 1
+                    self.streams[i].metrics.count('sync_dropped')
+                    heads[i] = peek(i)
+                if heads[i][2] is not None and heads[i][1] > target + tolerance:
+                    # the source has no frame near the target, move the target
+                    ahead = True
+                    break
+            if not ahead:
+                break
+
+        frames = {}
+        for i, head in enumerate(heads):
+            if head[2] is not None:
+                frames[i] = self.streams[i].read_item()[2]
+            elif not (self.streams[i].stopped and self.streams[i].Q.qsize() == 0):
+                self.streams[i].metrics.count('late')
+        timestamp = max(timestamps) if timestamps else None
+        if late == 'pad':
+            return timestamp, [frames.get(i) for i in range(self.streams_count)]
+        return timestamp, frames
+
+    def _read_item(self, idx, timeout=None):
+        return self.streams[idx].read_item(timeout)
+
+    def read_batch(self, n, idx=None, timeout=None):
+        '''
+            read up to n frames of a stream into one contiguous (N, ...) array
+
+            idx: index of the stream, None reads a batch from every stream
+            timeout: seconds to wait for each batch, None waits until n frames or the end of stream
+            return (batch, count, indices) or None if the stream is ended,
+            or a list of them if idx is None.
+        '''
+        if idx is None:
+            return [self.read_batch(n, i, timeout) for i in range(self.streams_count)]
+        assert isinstance(idx, int) and idx >= 0 and idx < self.streams_count, f'Type of var i does not match or i out of range[0:{self.streams_count - 1}]: {idx}'
+        return self.streams[idx].read_batch(n, timeout)
 
     # Insufficient to have consumer use while(more()) which does
     # not take into account if the producer has reached end of stream.
@@ -196,27 +462,39 @@ class MultiVideoStream(object):
         else:
             return self.more() or not self.stopped
 
-    def more(self, idx=None):
-        # return True if there are still frames in the queue. If stream is not stopped, try to wait a moment
+    def more(self, idx=None, timeout=None):
+        # return True if there are still frames in the queue. If stream is not stopped,
+        # wait until the next frame or the end of stream.
         if idx is not None:
             assert isinstance(idx, int) and idx >= 0 and idx < self.streams_count, f'Type of var i does not match or i out of range[0:{self.streams_count - 1}]: {idx}'
-            tries = 0
-            while self.Qs[idx].qsize() == 0 and not self.streams_stopped[idx] and tries < 5:
-                time.sleep(0.1)
-                tries += 1
-            return self.Qs[idx].qsize() > 0
-        else:        
-            tries = 0
-            while sum(q.qsize() for q in self.Qs) == 0 and not self.stopped and tries < 5:
-                time.sleep(0.1)
-                tries += 1
-            return sum(q.qsize() for q in self.Qs) > 0
-
-    def stop(self):
-        # wait until stream resources are released (producer thread might be still grabbing frame)
-        self.thread.join()
-        # indicate that the thread should be stopped
-        self.stopped = True
+            return self.streams[idx].more(timeout)
+        with self.cond:
+            self.cond.wait_for(lambda: any(q.qsize() > 0 for q in self.Qs) or all(q.closed for q in self.Qs), timeout)
+            return any(q.qsize() > 0 for q in self.Qs)
+
+    def stop(self, timeout=1.0):
+        # stop every source thread, they are woken up if blocked on a full queue
+        for stream in self.streams:
+            stream.stop(timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.running():
+            raise StopIteration
+        frames = self.read()
+        if frames is None or all(frame is None for frame in frames):
+            raise StopIteration
+        return frames
+
+    def __enter__(self):
+        if any(stream.thread.ident is None for stream in self.streams):
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
 
 
 if __name__ == '__main__':
@@ -7,9 +7,31 @@
 
 import os
 import cv2
-import glob
-from tqdm import tqdm
-from .utils import mkdir
+from .utils import mkdir, list_images, progress, log
+from .ffmpeg_utils import get_keyframes, read_scene_frames
+from .parallel import ImageWriterPool, imread_ordered, split_segments, run_segments, _segment_to_images
+from .pipeline import FramePipeline
+from .frame_shard import FrameShardWriter, FrameShardReader, is_frame_shard
+from .manifest import Manifest, manifest_filename, count_files
+from .video.metrics import get_metrics
+
+
+def sample_range(fps, step=1, sample_fps=None, start_time=None, end_time=None):
+    '''
+    frames kept by the sampling options, see video2images
+
+    return (start_frame, end_frame, keep), end_frame is None for the end of video,
+    and keep(index) tells if a frame in [start_frame, end_frame) is kept.
+    '''
+    start_frame = int(round((start_time or 0) * fps))
+    end_frame = int(round(end_time * fps)) if end_time is not None else None
+    ratio = sample_fps / fps if sample_fps and fps else 1
+    def keep(i):
+        n = i - start_frame
+        if n % max(1, int(step)): return False
+        # the first frame of each 1 / sample_fps interval
+        return ratio >= 1 or n == 0 or int(n * ratio) > int((n - 1) * ratio)
+    return start_frame, end_frame, keep
 
 
 class VideoImageConverter(object):
@@ -17,53 +39,253 @@ class VideoImageConverter(object):
     video image converter
 
     The class have two methods, video2images and images2video.
+    The stages are 'decode', 'encode' and the 'queue' of the encode workers.
     """
 
+    def __init__(self, metrics=None, log_interval=None, verbose=None):
+        '''
+        metrics: a Metrics, or True to make one, of the stages of every job, see stats()
+        log_interval: print a line of the stats every log_interval seconds, for headless runs
+        verbose: True or False shows or hides the progress bars and messages of this instance,
+                 None follows utils.set_verbose and VIPTOOLS_VERBOSE
+        '''
+        self.metrics = get_metrics(metrics, 'VideoImageConverter', log_interval)
+        self.verbose = verbose
+
+
+    def stats(self):
+        '''
+        stage timings, queue occupancy and frame counters of the jobs so far, see Metrics.stats
+        '''
+        return self.metrics.stats()
+
+
     def _get_video_writer(self, filename, type, fps, size):
         return cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*type), fps, size)
 
 
-    def video2images(slef, video_filename, imgdir='out'):
+    def video2images(self, video_filename, imgdir='out', workers=0, worker_type='thread', max_inflight=None, segments=0,
+                     step=1, sample_fps=None, start_time=None, end_time=None, keyframes_only=False, scene=None,
+                     output='images', resume=False, checkpoint=500):
         '''
         video to images
 
         video_filename: video file
         imgdir: temp path to save images
+        workers: number of jpeg encode workers, 0 means encode on the decode thread
+        worker_type: 'thread' or 'process'
+        max_inflight: max decoded frames waiting for encode, defaults to 4 * workers
+        segments: decode keyframe-aligned segments on this many processes, 0 means decode sequentially
+        output: 'images' writes one jpeg per frame,
+                'shard' appends jpeg frames to a few shard files in imgdir, with an index of them,
+                'raw' appends raw frames to shard files, which are read back by memmap.
+                shards are read by FrameShardReader and images2video, and written by one decode,
+                segments is for 'images' only.
+
+        sampling, the images are still named by their frame index in the video:
+        step: keep one frame of every step frames
+        sample_fps: keep about sample_fps frames per second
+        start_time, end_time: keep the frames in [start_time, end_time), the unit of time is seconds
+        keyframes_only: keep the keyframes only, found without decoding and read by seeking
+        scene: keep the first frame and the frames whose scene score is above this threshold in [0, 1],
+               ffmpeg scores and decodes the video in one pass and passes on the kept frames only
+        skipped frames are grabbed but never retrieved nor encoded.
+
+        resume: a manifest in imgdir records the source, the sampling and the last written frame,
+                a rerun goes on from the frame after it, and a finished job is skipped while
+                its images are all in imgdir. 'shard' and 'raw' outputs and segments are skipped
+                when finished, or written again.
+        checkpoint: record the last written frame every checkpoint frames
         '''
+        if output not in ['images', 'shard', 'raw']:
+            raise ValueError('output only supports \'images\', \'shard\' and \'raw\'.')
         mkdir(imgdir)
         video_capture = cv2.VideoCapture(video_filename)
         length = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
         fps = video_capture.get(cv2.CAP_PROP_FPS)
         width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        print('In \'{}\', length: {}, fps: {}, width: {}, height: {}'.format(os.path.basename(video_filename), length, fps, width, height))
+        log('In \'{}\', length: {}, fps: {}, width: {}, height: {}'.format(os.path.basename(video_filename), length, fps, width, height), verbose=self.verbose)
+
+        manifest = None
+        resume_frame = 0
+        if resume:
+            params = {'step': step, 'sample_fps': sample_fps, 'start_time': start_time, 'end_time': end_time,
+                      'keyframes_only': keyframes_only, 'scene': scene, 'output': output}
+            manifest = Manifest(manifest_filename(imgdir), video_filename, params)
+            if manifest.output_done(imgdir):
+                video_capture.release()
+                log('video2images: {} is done, skip it'.format(imgdir), verbose=self.verbose)
+                return
+            # images may be lost since, then the job starts again
+            if output == 'images' and not (segments and segments > 1) and count_files(imgdir) >= manifest.get('written', 0):
+                resume_frame = manifest.get('last_frame', -1) + 1
+            if resume_frame > 0:
+                log('video2images: resume from frame {}'.format(resume_frame), verbose=self.verbose)
+
+        sampled = step > 1 or sample_fps or start_time or end_time is not None or keyframes_only or scene is not None
+        if sampled:
+            if segments and segments > 1:
+                video_capture.release()
+                raise ValueError('segments cannot be used with sampling.')
+            frames = self._sample_frames(video_filename, video_capture, length, fps, step, sample_fps, start_time, end_time, keyframes_only, scene, resume_frame)
+            self._write_images(frames, imgdir, workers, worker_type, max_inflight, video_capture, None, output, fps, manifest, checkpoint)
+            return
+
+        if segments and segments > 1 and output == 'images':
+            video_capture.release()
+            self._video2images_segments(video_filename, imgdir, length, segments)
+            if manifest is not None:
+                manifest.finish_output(imgdir)
+            return
+
+        frames = self._sample_frames_by(video_capture, resume_frame, None, keyframes=self._keyframes(video_filename, resume_frame))
+        self._write_images(frames, imgdir, workers, worker_type, max_inflight, video_capture, length - resume_frame, output, fps, manifest, checkpoint)
+
 
-        pbar = tqdm(total=length, desc='video2image')
-        c = 0
-        while video_capture.isOpened():
+    def _write_images(self, frames, imgdir, workers, worker_type, max_inflight, video_capture, total, output='images', fps=None,
+                      manifest=None, checkpoint=500):
+        pbar = progress(total=total, desc='video2image', verbose=self.verbose)
+        frames = self.metrics.timed('decode', frames)
+        try:
+            # decode stays sequential, encode and write run on the pool
+            if output == 'images':
+                writer = ImageWriterPool(workers, worker_type, max_inflight)
+            else:
+                encoding = 'jpg' if output == 'shard' else 'raw'
+                writer = FrameShardWriter(imgdir, encoding, workers=workers, worker_type=worker_type, max_inflight=max_inflight, fps=fps)
+            with writer:
+                for c, (index, frame) in enumerate(frames, 1):
+                    # with workers, the time to submit, or wait for a free worker
+                    with self.metrics.timer('encode'):
+                        if output == 'images':
+                            # img index start from 1.
+                            writer.write(os.path.join(imgdir, '{}.jpg'.format(index + 1)), frame)
+                        else:
+                            # shards keep the 0-based frame index
+                            writer.write(index, frame)
+                    pbar.update(1)
+                    if self.metrics.enabled:
+                        self.metrics.count('frames')
+                        if workers:
+                            self.metrics.gauge('queue', len(writer.pending))
+                        self.metrics.tick()
+                    if manifest is not None and output == 'images' and c % checkpoint == 0:
+                        # the frames before are all on disk once the pool is flushed
+                        writer.flush()
+                        manifest.update(last_frame=index, written=count_files(imgdir))
+            if manifest is not None:
+                manifest.finish_output(imgdir)
+        finally:
+            pbar.close()
+            video_capture.release()
+            self.metrics.export()
+
+
+    def _sample_frames(self, video_filename, video_capture, length, fps, step, sample_fps, start_time, end_time, keyframes_only, scene, resume_frame=0):
+        # yield (index, frame) of the sampled frames from resume_frame
+        start_frame, end_frame, keep = sample_range(fps, step, sample_fps, start_time, end_time)
+        in_range = lambda i: i >= max(start_frame, resume_frame) and (end_frame is None or i < end_frame)
+
+        if scene is not None:
+            # ffmpeg scores and decodes in one pass, the opencv capture is not used
+            for index, frame in read_scene_frames(video_filename, scene):
+                if end_frame is not None and index >= end_frame: break
+                if in_range(index):
+                    yield index, frame
+            return
+
+        if keyframes_only:
+            keyframes = get_keyframes(video_filename)[0]
+            indices = [k for k in keyframes if in_range(k)]
+            if not indices: return
+            # a seek decodes from the keyframe before, so it only pays off for
+            # sparse keyframes. All-intra videos are cheaper to grab in order.
+            if (indices[-1] - indices[0] + 1) >= 8 * len(indices):
+                yield from self._seek_frames(video_capture, indices)
+            else:
+                yield from self._sample_frames_by(video_capture, indices[0], indices[-1] + 1, set(indices).__contains__, keyframes)
+            return
+
+        # the sampling phase still follows start_frame
+        start_frame = max(start_frame, resume_frame)
+        yield from self._sample_frames_by(video_capture, start_frame, end_frame, keep, self._keyframes(video_filename, start_frame))
+
+
+    def _keyframes(self, video_filename, start_frame):
+        # keyframe indices to seek to start_frame, none are needed from the first frame
+        if start_frame <= 0:
+            return []
+        try:
+            return get_keyframes(video_filename)[0]
+        except ValueError:
+            return []
+
+
+    def _sample_frames_by(self, video_capture, start_frame, end_frame, keep=None, keyframes=None):
+        # yield (index, frame) of the frames in [start_frame, end_frame) kept by keep(index),
+        # the others are grabbed only, and never converted to BGR.
+        # a seek by frame number is not accurate for every video, so it seeks to the
+        # keyframe before start_frame only, and grabs forward to start_frame.
+        index = max([k for k in keyframes or [] if k <= start_frame] or [0])
+        if index > 0:
+            video_capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        while video_capture.isOpened() and (end_frame is None or index < end_frame):
+            if not video_capture.grab(): break
+            if index >= start_frame and (keep is None or keep(index)):
+                rval, frame = video_capture.retrieve()
+                if not rval: break
+                yield index, frame
+            index += 1
+
+
+    def _seek_frames(self, video_capture, indices):
+        # yield (index, frame) of each index by seeking
+        for index in indices:
+            video_capture.set(cv2.CAP_PROP_POS_FRAMES, index)
             rval, frame = video_capture.read()
             if not rval: break
-            # index of image
-            c += 1
-            # and img index start from 1.
-            cv2.imwrite(os.path.join(imgdir, '{}.jpg'.format(c)), frame)
-            pbar.update(1)
-        video_capture.release()
+            yield index, frame
 
 
-    def images2video(self, imgdir, video_filename='out.avi', fps=20):
+    def _video2images_segments(self, video_filename, imgdir, length, segments):
+        keyframes, frame_count = get_keyframes(video_filename)
+        # each process seeks to its own keyframe, and names images by the global index
+        jobs = [(video_filename, imgdir, start, end) for start, end in split_segments(keyframes, 0, None, segments, frame_count)]
+        pbar = progress(total=length, desc='video2image', verbose=self.verbose)
+        try:
+            run_segments(_segment_to_images, jobs, pbar)
+        finally:
+            pbar.close()
+
+
+    def images2video(self, imgdir, video_filename='out.avi', fps=20, workers=0, worker_type='thread', prefetch=None):
         '''
         images to video
 
-        imgdir: imges dir
+        imgdir: imges dir, or a shard folder written by video2images
         video_filename: generate video's filename
         fps: create video's fps, it's better as same as origin video
+        workers: number of jpeg decode workers, 0 means decode on the writer thread
+        worker_type: 'thread' or 'process'
+        prefetch: max images decoded ahead of the writer, defaults to 4 * workers
         '''
-        imgs = glob.glob(os.path.join(imgdir, '*.jpg'))
-        if len(imgs) <= 0: return
-        
-        img = cv2.imread(imgs[0])
-        height, width = img.shape[0], img.shape[1]
+        if is_frame_shard(imgdir):
+            reader = FrameShardReader(imgdir)
+            if len(reader) <= 0: return
+            height, width = reader[0].shape[:2]
+            total = len(reader)
+            frames = reader.frames(workers, worker_type, prefetch)
+        else:
+            imgs = list_images(imgdir)
+            if len(imgs) <= 0: return
+
+            img = cv2.imread(imgs[0])
+            height, width = img.shape[0], img.shape[1]
+            total = len(imgs)
+            # images are decoded ahead on the pool, and written strictly in index order
+            frames = imread_ordered(imgs, workers, worker_type, prefetch)
+        frames = self.metrics.timed('decode', frames)
         # judge video format
         if video_filename and isinstance(video_filename, str) and len(video_filename) > 4:
             if video_filename[-3:].lower() == 'mp4':
@@ -76,6 +298,9 @@ class VideoImageConverter(object):
             raise ValueError(f'video_filename is not str or too short: {video_filename}')
 
         videoWriter = self._get_video_writer(video_filename, type_, fps, (width, height))
-        for i in tqdm(sorted(imgs, key=lambda f: int(os.path.basename(os.path.normpath(f.split(".jpg", 1)[0])))), desc='image2video'):
-            videoWriter.write(cv2.imread(i))
-        videoWriter.release()
+        pbar = progress(total=total, desc='image2video', verbose=self.verbose)
+        try:
+            FramePipeline(videoWriter, pbar=pbar, metrics=self.metrics).run(frames)
+        finally:
+            pbar.close()
+            self.metrics.export()
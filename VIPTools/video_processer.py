@@ -8,56 +8,260 @@
 import os
 import cv2
 import glob
-from tqdm import tqdm
-from .utils import mkdir
+import warnings
+from .utils import mkdir, progress, log
+from .ffmpeg_utils import ENCODERS, MP4_CODECS, SMART_CODECS, parse_rational, probe_video, probe_packets, get_keyframes, \
+    concat_videos, cut_copy, cut_encode, remux, transcode
+from .parallel import split_segments, run_segments, _segment_to_video, ImageWriterPool
+from .pipeline import FramePipeline, read_frames
+from .video_image_converter import sample_range
+from .manifest import Manifest, manifest_filename
+from .video.metrics import get_metrics
 
 
 class VideoProcesser(object):
     """
     video processer
 
-    the class has two methods, avi2mp4 and crop_video.
+    the class has three methods, avi2mp4, crop_video and fan_out.
+    The stages are 'decode', 'encode' and the 'queue' between them,
+    and the ffmpeg runs of 'remux', 'transcode', 'copy' and 'smart_crop'.
+    Each output of fan_out has its own child metrics.
     """
 
+    def __init__(self, metrics=None, log_interval=None, verbose=None):
+        '''
+        metrics: a Metrics, or True to make one, of the stages of every job, see stats()
+        log_interval: print a line of the stats every log_interval seconds, for headless runs
+        verbose: True or False shows or hides the progress bars and messages of this instance,
+                 None follows utils.set_verbose and VIPTOOLS_VERBOSE
+        '''
+        self.metrics = get_metrics(metrics, 'VideoProcesser', log_interval)
+        self.verbose = verbose
+
+
+    def stats(self):
+        '''
+        stage timings, queue occupancy and frame counters of the jobs so far, see Metrics.stats
+        '''
+        return self.metrics.stats()
+
+
     def _get_video_writer(self, filename, type, fps, size):
         return cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*type), fps, size)
-    
 
-    def avi2mp4(self, avi_filename, mp4_filename):
+
+    def _get_video_type(self, filename, name='filename'):
+        # fourcc of the opencv writer, by the file extension
+        if filename and isinstance(filename, str) and len(filename) > 4:
+            if filename[-3:].lower() == 'mp4':
+                return 'mp4v'
+            elif filename[-3:].lower() == 'avi':
+                return 'MJPG'
+            else:
+                raise ValueError(f'{name} only supports .avi and .mp4.')
+        else:
+            raise ValueError(f'{name} error: {filename}')
+
+
+    def _segments_to_video(self, video_filename, filename, type_, fps, size, start_frame, end_frame, segments, desc):
+        '''
+        decode keyframe-aligned segments on processes, then concat the parts by stream copy
+        '''
+        keyframes, frame_count = get_keyframes(video_filename)
+        segs = split_segments(keyframes, start_frame, end_frame, segments, frame_count)
+        root, ext = os.path.splitext(filename)
+        part_filenames = ['{}.part{}{}'.format(root, i, ext) for i in range(len(segs))]
+        jobs = [(video_filename, part_filename, type_, fps, size, start, end) for part_filename, (start, end) in zip(part_filenames, segs)]
+        total = (end_frame if end_frame is not None else frame_count) - start_frame
+        pbar = progress(total=total, desc=desc, verbose=self.verbose)
+        try:
+            run_segments(_segment_to_video, jobs, pbar)
+            concat_videos(part_filenames, filename)
+        finally:
+            pbar.close()
+            for part_filename in part_filenames:
+                if os.path.exists(part_filename):
+                    os.remove(part_filename)
+
+
+    def avi2mp4(self, avi_filename, mp4_filename, segments=0, mode='auto', vcodec='libx264', preset='medium', threads=0, resume=False):
         '''
         avi to mp4
 
         avi_filename: source filename
         mp4_filename: dest   filename
+        segments: decode keyframe-aligned segments on this many processes for the opencv path,
+                  0 means decode sequentially. ffmpeg runs the remux and transcode paths,
+                  so 'auto' uses it only if it falls back to opencv.
+        mode: 'remux' copies the stream when the codec fits in mp4,
+              'transcode' decodes and encodes with ffmpeg,
+              'opencv' decodes and encodes with opencv 'mp4v',
+              'auto' tries them in this order.
+        vcodec, preset, threads: ffmpeg encoder, its preset and threads, for the transcode path
+        resume: skip the job if mp4_filename was made from the same avi with the same options,
+                as recorded by the manifest beside it
+        return the path used.
         '''
+        if mode not in ['auto', 'remux', 'transcode', 'opencv']:
+            raise ValueError('mode only supports \'auto\', \'remux\', \'transcode\' and \'opencv\'.')
+        if segments and mode in ['remux', 'transcode']:
+            raise ValueError('segments only supports mode \'auto\' and \'opencv\'.')
+        mkdir(os.path.dirname(mp4_filename))
+
+        manifest = None
+        if resume:
+            manifest = Manifest(manifest_filename(mp4_filename), avi_filename, {'mode': mode, 'vcodec': vcodec, 'preset': preset})
+            if manifest.output_done(mp4_filename):
+                log('avi2mp4: {} is done, skip it'.format(mp4_filename), verbose=self.verbose)
+                return manifest.get('path')
+        try:
+            path = self._avi2mp4(avi_filename, mp4_filename, segments, mode, vcodec, preset, threads)
+        finally:
+            self.metrics.export()
+        if manifest is not None:
+            manifest.finish_output(mp4_filename, path=path)
+        return path
+
+
+    def _avi2mp4(self, avi_filename, mp4_filename, segments, mode, vcodec, preset, threads):
+        try:
+            video_info = probe_video(avi_filename)
+        except ValueError:
+            if mode in ['remux', 'transcode']: raise
+            video_info = {}
+
+        if mode in ['auto', 'remux']:
+            if video_info.get('codec_name') in MP4_CODECS:
+                try:
+                    # avi is constant rate, r_frame_rate is the rate in its header
+                    with self.metrics.timer('remux'):
+                        remux(avi_filename, mp4_filename, video_info.get('r_frame_rate') if parse_rational(video_info.get('r_frame_rate')) else None,
+                              video_info.get('codec_name'))
+                    log('avi2mp4: remux {} to {}'.format(avi_filename, mp4_filename), verbose=self.verbose)
+                    return 'remux'
+                except RuntimeError:
+                    if mode == 'remux': raise
+            elif mode == 'remux':
+                raise ValueError('codec {} cannot be remuxed to mp4.'.format(video_info.get('codec_name')))
+
+        if mode in ['auto', 'transcode'] and video_info:
+            try:
+                with self.metrics.timer('transcode'):
+                    transcode(avi_filename, mp4_filename, vcodec, preset, threads)
+                log('avi2mp4: transcode {} to {} by {}'.format(avi_filename, mp4_filename, vcodec), verbose=self.verbose)
+                return 'transcode'
+            except RuntimeError:
+                if mode == 'transcode': raise
+
+        self._avi2mp4_opencv(avi_filename, mp4_filename, video_info, segments)
+        log('avi2mp4: opencv {} to {}'.format(avi_filename, mp4_filename), verbose=self.verbose)
+        return 'opencv'
+
+
+    def _avi2mp4_opencv(self, avi_filename, mp4_filename, video_info, segments=0):
         video_capture = cv2.VideoCapture(avi_filename)
-        length = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = video_capture.get(cv2.CAP_PROP_FPS)
+        # prefer the stream info, opencv reports 0 or inf for some avi
+        nb_frames = str(video_info.get('nb_frames', ''))
+        length = int(nb_frames) if nb_frames.isdigit() else int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = parse_rational(video_info.get('r_frame_rate')) or parse_rational(video_info.get('avg_frame_rate')) \
+            or parse_rational(video_capture.get(cv2.CAP_PROP_FPS))
+        if fps is None:
+            warnings.warn('Unknown fps of {}, use 20 instead.'.format(avi_filename))
+            fps = 20
         width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        print(mp4_filename, length, fps, (width, height))
+        log(mp4_filename, length, fps, (width, height), verbose=self.verbose)
 
-        mkdir(os.path.dirname(mp4_filename))
-        
-        video_writer = self._get_video_writer(mp4_filename, 'mp4v', fps if fps not in [float('inf'), float('nan')] else 20, (width, height))
-        pbar = tqdm(total=length, desc='avi2mp4')
-        while video_capture.isOpened():
-            rval, frame = video_capture.read()
-            if not rval: break
-            video_writer.write(frame)
-            pbar.update(1)
-        video_capture.release()
-        video_writer.release()
-
-
-    def crop_video(self, video_filename, crop_filename, start_time=None, end_time=None):
+        if segments and segments > 1:
+            video_capture.release()
+            self._segments_to_video(avi_filename, mp4_filename, 'mp4v', fps, (width, height), 0, None, segments, 'avi2mp4')
+            return
+
+        video_writer = self._get_video_writer(mp4_filename, 'mp4v', fps, (width, height))
+        pbar = progress(total=length, desc='avi2mp4', verbose=self.verbose)
+        try:
+            FramePipeline(video_writer, pbar=pbar, metrics=self.metrics).run(self.metrics.timed('decode', read_frames(video_capture)))
+        finally:
+            pbar.close()
+
+
+    def _smart_crop(self, video_filename, crop_filename, fps, start_frame, end_frame):
+        '''
+        copy the whole GOPs inside [start_frame, end_frame), and re-encode
+        only the partial GOPs at the two cut boundaries.
+        '''
+        stream, packets = probe_packets(video_filename)
+        codec_name = stream.get('codec_name')
+        if codec_name not in SMART_CODECS:
+            raise ValueError('smart crop does not support codec: {}'.format(codec_name))
+        end_frame = min(end_frame, len(packets))
+        keyframes = [i for i, p in enumerate(packets) if 'K' in p.get('flags', '') and start_frame <= i <= end_frame]
+        # with no keyframe inside, the whole range is a boundary
+        first_key = keyframes[0] if keyframes else end_frame
+        last_key = keyframes[-1] if keyframes else end_frame
+
+        # the concat demuxer carries the codec extradata change between matroska parts
+        ext = '.mkv'
+        encode_args = {'pix_fmt': stream.get('pix_fmt')} if stream.get('pix_fmt') else {}
+        encode_args['crf'] = 18
+        root, _ = os.path.splitext(crop_filename)
+        part_filenames = []
+        try:
+            # seek times are shifted inside the first frame, so the seek never rounds to a neighbour
+            if first_key > start_frame:
+                part_filenames.append(root + '.head' + ext)
+                cut_encode(video_filename, part_filenames[-1], max(start_frame - 0.5, 0) / fps, first_key - start_frame, ENCODERS[codec_name], **encode_args)
+            if last_key > first_key:
+                part_filenames.append(root + '.body' + ext)
+                # whole GOPs are closed, so the packets in decode order are exactly these frames
+                cut_copy(video_filename, part_filenames[-1], (first_key + 0.25) / fps, frames=last_key - first_key)
+            if end_frame > last_key:
+                part_filenames.append(root + '.tail' + ext)
+                cut_encode(video_filename, part_filenames[-1], (last_key - 0.5) / fps, end_frame - last_key, ENCODERS[codec_name], **encode_args)
+            concat_videos(part_filenames, crop_filename)
+        finally:
+            for part_filename in part_filenames:
+                if os.path.exists(part_filename):
+                    os.remove(part_filename)
+
+
+    def crop_video(self, video_filename, crop_filename, start_time=None, end_time=None, segments=0, mode='reencode', resume=False):
         '''
         crop video
 
         start_time defaults to 0, end_time defaults to length,
         and the unit of time is seconds.
+        segments: decode keyframe-aligned segments on this many processes, 0 means decode sequentially,
+                  only for mode 'reencode'
+        mode: 'reencode' decodes and encodes every frame with opencv,
+              'copy' copies packets without decoding, the clip starts at the keyframe before start_time,
+              'smart' copies packets and re-encodes only the partial GOPs at the cut boundaries,
+              for h264 and hevc, other codecs are re-encoded as 'reencode'.
+              'copy' and 'smart' keep the source codec and write the video stream only.
+        resume: skip the job if crop_filename was cropped from the same video with the same options,
+                as recorded by the manifest beside it
         '''
+        if mode not in ['reencode', 'copy', 'smart']:
+            raise ValueError('mode only supports \'reencode\', \'copy\' and \'smart\'.')
+        if segments and mode != 'reencode':
+            raise ValueError('segments only supports mode \'reencode\'.')
+
+        manifest = None
+        if resume:
+            manifest = Manifest(manifest_filename(crop_filename), video_filename, {'start_time': start_time, 'end_time': end_time, 'mode': mode})
+            if manifest.output_done(crop_filename):
+                log('crop_video: {} is done, skip it'.format(crop_filename), verbose=self.verbose)
+                return
+        try:
+            self._crop_video(video_filename, crop_filename, start_time, end_time, segments, mode)
+        finally:
+            self.metrics.export()
+        if manifest is not None:
+            manifest.finish_output(crop_filename)
 
+
+    def _crop_video(self, video_filename, crop_filename, start_time, end_time, segments, mode):
         # load video info
         video_capture = cv2.VideoCapture(video_filename)
         length = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -66,15 +270,7 @@ class VideoProcesser(object):
         height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
         # judge video format
-        if crop_filename and isinstance(crop_filename, str) and len(crop_filename) > 4:
-            if crop_filename[-3:].lower() == 'mp4':
-                type_ = 'mp4v'
-            elif crop_filename[-3:].lower() == 'avi':
-                type_ = 'MJPG'
-            else:
-                raise ValueError(f'crop_filename only supports .avi and .mp4.')
-        else:
-            raise ValueError(f'crop_filename error: {crop_filename}')
+        type_ = self._get_video_type(crop_filename, 'crop_filename')
 
         mkdir(os.path.dirname(crop_filename))
 
@@ -84,18 +280,145 @@ class VideoProcesser(object):
         start_frame = int((start_time or 0) * fps)
         end_frame = int((end_time or (length / fps)) * fps)
 
+        if mode == 'copy':
+            video_capture.release()
+            with self.metrics.timer('copy'):
+                cut_copy(video_filename, crop_filename, start_time, end_time)
+            return
+        elif mode == 'smart':
+            codec_name = probe_video(video_filename).get('codec_name')
+            if codec_name in SMART_CODECS:
+                video_capture.release()
+                with self.metrics.timer('smart_crop'):
+                    self._smart_crop(video_filename, crop_filename, fps, start_frame, end_frame)
+                return
+            log('crop_video: smart crop does not support codec {}, re-encode it'.format(codec_name), verbose=self.verbose)
+
+        if segments and segments > 1:
+            video_capture.release()
+            desc = 'crop {} to {}'.format(os.path.basename(video_filename), os.path.basename(crop_filename))
+            self._segments_to_video(video_filename, crop_filename, type_, fps, (width, height), start_frame, end_frame, segments, desc)
+            return
+
         # jump to video start frame
         video_capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
 
         # write to croped video
         video_writer = self._get_video_writer(crop_filename, type_, fps, (width, height))
-        pbar = tqdm(total=end_frame - start_frame, desc='crop {} to {}'.format(os.path.basename(video_filename), os.path.basename(crop_filename)))
-        for _ in range(start_frame, end_frame):
-            if video_capture.isOpened():
-                rval, frame = video_capture.read()
-                if not rval: break
-                video_writer.write(frame)
+        pbar = progress(total=end_frame - start_frame, desc='crop {} to {}'.format(os.path.basename(video_filename), os.path.basename(crop_filename)), verbose=self.verbose)
+        try:
+            FramePipeline(video_writer, pbar=pbar, metrics=self.metrics).run(self.metrics.timed('decode', read_frames(video_capture, end_frame - start_frame)))
+        finally:
+            pbar.close()
+
+
+    def fan_out(self, video_filename, outputs, queue_size=32):
+        '''
+        serve several outputs from one sequential decode
+
+        outputs: list of dicts, each is one output:
+            {'type': 'video', 'filename': 'clip.mp4', 'start_time': 10, 'end_time': 20}
+                a clip encoded by opencv, .avi or .mp4, the whole video without times
+            {'type': 'images', 'imgdir': 'out', 'step': 1, 'sample_fps': None, 'start_time': None, 'end_time': None,
+             'workers': 0, 'worker_type': 'thread'}
+                images named by frame index, as video2images
+        queue_size: max frames waiting for each output
+        each frame is decoded once, and sent to every output that needs it.
+        every output is written on its own thread.
+        return the number of frames decoded.
+        '''
+        # every output is checked before anything is opened or named in the metrics
+        names = []
+        for output in outputs:
+            type_ = output.get('type', 'video')
+            if type_ not in ['video', 'images']:
+                raise ValueError('output type only supports \'video\' and \'images\'.')
+            key = 'filename' if type_ == 'video' else 'imgdir'
+            if not isinstance(output.get(key), str) or len(output[key]) == 0:
+                raise ValueError('{} output has no {}: {}'.format(type_, key, output))
+            if type_ == 'video':
+                self._get_video_type(output['filename'])
+            names.append(output[key])
+
+        video_capture = cv2.VideoCapture(video_filename)
+        length = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = video_capture.get(cv2.CAP_PROP_FPS)
+        width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # (start_frame, end_frame, keep, pipeline, is_images) of each output
+        sinks = []
+        try:
+            for output, name in zip(outputs, names):
+                output = dict(output)
+                type_ = output.pop('type', 'video')
+                if type_ == 'video':
+                    filename = output['filename']
+                    fourcc = self._get_video_type(filename)
+                    start_frame, end_frame, keep = sample_range(fps, start_time=output.get('start_time'), end_time=output.get('end_time'))
+                    mkdir(os.path.dirname(filename))
+                    writer = self._get_video_writer(filename, fourcc, fps, (width, height))
+                elif type_ == 'images':
+                    imgdir = output['imgdir']
+                    start_frame, end_frame, keep = sample_range(fps, output.get('step', 1), output.get('sample_fps'), output.get('start_time'), output.get('end_time'))
+                    mkdir(imgdir)
+                    writer = _ImageSink(imgdir, output.get('workers', 0), output.get('worker_type', 'thread'))
+                metrics = self.metrics.child(name)
+                sinks.append((start_frame, end_frame, keep, FramePipeline(writer, queue_size, metrics=metrics).start(), type_ == 'images'))
+        except BaseException:
+            for sink in sinks:
+                sink[3].close()
+            video_capture.release()
+            raise
+
+        # decode the union of the ranges only
+        first_frame = min([sink[0] for sink in sinks] or [0])
+        last_frame = None if any(sink[1] is None for sink in sinks) else max([sink[1] for sink in sinks] or [0])
+        if first_frame > 0:
+            video_capture.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
+        pbar = progress(total=(last_frame if last_frame is not None else length) - first_frame, desc='fan out {}'.format(os.path.basename(video_filename)), verbose=self.verbose)
+        index = first_frame
+        errors = []
+        try:
+            while video_capture.isOpened() and (last_frame is None or index < last_frame):
+                with self.metrics.timer('decode'):
+                    if not video_capture.grab(): break
+                    wanted = [sink for sink in sinks if sink[0] <= index and (sink[1] is None or index < sink[1]) and sink[2](index)]
+                    if wanted:
+                        # frames no output needs are never retrieved
+                        rval, frame = video_capture.retrieve()
+                        if not rval: break
+                for sink in wanted:
+                    sink[3].put((index, frame) if sink[4] else frame)
+                index += 1
                 pbar.update(1)
+                self.metrics.count('frames')
+                self.metrics.tick()
+        finally:
+            pbar.close()
+            video_capture.release()
+            # a failed output does not stop the others
+            for sink in sinks:
+                try:
+                    sink[3].close()
+                except BaseException as e:
+                    errors.append(e)
+        self.metrics.export()
+        if errors:
+            raise errors[0]
+        return index - first_frame
+
+
+class _ImageSink(object):
+    # writes (index, frame) as '{index + 1}.jpg', as a video writer of FramePipeline
+
+    def __init__(self, imgdir, workers=0, worker_type='thread'):
+        self.imgdir = imgdir
+        self.pool = ImageWriterPool(workers, worker_type)
+
+    def write(self, item):
+        index, frame = item
+        self.pool.write(os.path.join(self.imgdir, '{}.jpg'.format(index + 1)), frame)
 
-        video_capture.release()
-        video_writer.release()
+    def release(self):
+        self.pool.close()
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : __init__.py
+'''
+
+from .runner import run, compare
+
+
+__all__ = ['run', 'compare']
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : __main__.py
+'''
+
+import fire
+from benchmarks import run, compare
+
+
+if __name__ == '__main__':
+    fire.Fire({'run': run, 'compare': compare})
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : cases.py
+'''
+
+import os
+import shutil
+from contextlib import contextmanager
+from tqdm import tqdm
+from VIPTools import VideoImageConverter, VideoProcesser
+from VIPTools.video.video_capture import VideoCapture
+from VIPTools.video.video_stream import VideoStream, MultiVideoStream
+
+
+@contextmanager
+def _marking_progress(mark):
+    # the processers report each frame to their tqdm bar, the first update is the first frame
+    update = tqdm.update
+    def marked_update(self, n=1):
+        mark()
+        return update(self, n)
+    tqdm.update = marked_update
+    try:
+        yield
+    finally:
+        tqdm.update = update
+
+
+def _clean(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _frame_count(filename):
+    cap = VideoCapture(filename, quiet=True, probe_cache=False)
+    cap.release()
+    return cap.frame_count
+
+
+# each case is (source extension, setup, run), setup(src, workdir) returns the state of run,
+# run(state, mark) returns the number of frames, and calls mark() on each frame
+
+def _video2images_setup(src, workdir):
+    imgdir = os.path.join(workdir, 'video2images')
+    _clean(imgdir)
+    return {'src': src, 'imgdir': imgdir, 'frames': _frame_count(src)}
+
+
+def _video2images(state, mark):
+    with _marking_progress(mark):
+        VideoImageConverter().video2images(state['src'], state['imgdir'], resume=False)
+    return state['frames']
+
+
+def _images2video_setup(src, workdir):
+    # the images are made once, only images2video is measured
+    imgdir = os.path.join(workdir, 'images2video', os.path.basename(src))
+    if not os.path.isdir(imgdir):
+        VideoImageConverter().video2images(src, imgdir, resume=False)
+    video_filename = os.path.join(workdir, 'images2video.avi')
+    _clean(video_filename)
+    return {'imgdir': imgdir, 'video_filename': video_filename, 'frames': _frame_count(src)}
+
+
+def _images2video(state, mark):
+    with _marking_progress(mark):
+        VideoImageConverter().images2video(state['imgdir'], state['video_filename'], fps=25)
+    return state['frames']
+
+
+def _avi2mp4_setup(src, workdir):
+    mp4_filename = os.path.join(workdir, 'avi2mp4.mp4')
+    _clean(mp4_filename)
+    return {'src': src, 'mp4_filename': mp4_filename, 'frames': _frame_count(src)}
+
+
+def _avi2mp4(state, mark):
+    # the opencv path, 'auto' would pick remux or transcode by the ffmpeg build and the
+    # codec, and they are run by ffmpeg with no first frame mark
+    with _marking_progress(mark):
+        VideoProcesser().avi2mp4(state['src'], state['mp4_filename'], mode='opencv', resume=False)
+    return state['frames']
+
+
+def _crop_video_setup(src, workdir):
+    crop_filename = os.path.join(workdir, 'crop_video.mp4')
+    _clean(crop_filename)
+    cap = VideoCapture(src, quiet=True, probe_cache=False)
+    cap.release()
+    # the middle half of the video
+    duration = cap.frame_count / cap.fps
+    return {'src': src, 'crop_filename': crop_filename, 'start_time': duration / 4, 'end_time': duration * 3 / 4,
+            'frames': int(round(duration / 2 * cap.fps))}
+
+
+def _crop_video(state, mark):
+    with _marking_progress(mark):
+        VideoProcesser().crop_video(state['src'], state['crop_filename'], state['start_time'], state['end_time'], mode='reencode', resume=False)
+    return state['frames']
+
+
+def _capture_setup(src, workdir):
+    return {'src': src}
+
+
+def _capture_read(state, mark, type):
+    cap = VideoCapture(state['src'], quiet=True, pix_fmt='bgr24', probe_cache=False)
+    frames = 0
+    while cap.read(type=type) is not None:
+        mark()
+        frames += 1
+    cap.release()
+    return frames
+
+
+def _capture_bytes(state, mark):
+    return _capture_read(state, mark, 'bytes')
+
+
+def _capture_numpy(state, mark):
+    return _capture_read(state, mark, 'numpy')
+
+
+def _video_stream(state, mark):
+    frames = 0
+    with VideoStream(state['src'], pix_fmt='bgr24', probe_cache=False) as stream:
+        for _ in stream:
+            mark()
+            frames += 1
+    return frames
+
+
+def _multi_video_stream(state, mark):
+    # two sources of the same video, read as sets
+    frames = 0
+    source_dict = {'uri': state['src'], 'pix_fmt': 'bgr24', 'probe_cache': False}
+    with MultiVideoStream([source_dict, source_dict]) as streams:
+        for group in streams:
+            mark()
+            frames += sum(frame is not None for frame in group)
+    return frames
+
+
+CASES = {
+    'video2images': ('.mp4', _video2images_setup, _video2images),
+    'images2video': ('.mp4', _images2video_setup, _images2video),
+    'avi2mp4': ('.avi', _avi2mp4_setup, _avi2mp4),
+    'crop_video': ('.mp4', _crop_video_setup, _crop_video),
+    'capture_bytes': ('.mp4', _capture_setup, _capture_bytes),
+    'capture_numpy': ('.mp4', _capture_setup, _capture_numpy),
+    'video_stream': ('.mp4', _capture_setup, _video_stream),
+    'multi_video_stream': ('.mp4', _capture_setup, _multi_video_stream),
+}
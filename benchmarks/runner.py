@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : runner.py
+'''
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import tempfile
+import subprocess
+import statistics
+import multiprocessing as mp
+from .synthetic import SIZES, get_video
+from .cases import CASES
+
+
+# the default regression threshold, a relative change of fps, time to first frame and peak rss
+THRESHOLD = 0.1
+# changes of time to first frame below this many seconds are noise
+MIN_TTFF_CHANGE = 0.005
+
+
+def _split(value):
+    # fire passes 'a,b' as a tuple, and 'a' as a str
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return [v for v in value.split(',') if v]
+    return list(value)
+
+
+def _run_case(name, src, workdir, conn):
+    # runs in a fresh process, so the peak rss is of this case only
+    try:
+        from VIPTools.utils import set_verbose
+        set_verbose(False)
+        _, setup, run = CASES[name]
+        state = setup(src, workdir)
+        first = []
+        def mark():
+            if not first:
+                first.append(time.perf_counter())
+        start = time.perf_counter()
+        frames = run(state, mark)
+        seconds = time.perf_counter() - start
+        # ru_maxrss is in KB on Linux
+        conn.send({
+            'frames': frames,
+            'seconds': seconds,
+            'fps': frames / seconds if seconds > 0 else None,
+            'ttff': first[0] - start if first else None,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        })
+    except Exception as e:
+        conn.send({'error': '{}: {}'.format(type(e).__name__, e)})
+    finally:
+        conn.close()
+
+
+def _measure(name, src, workdir):
+    ctx = mp.get_context('spawn')
+    recv, send = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_case, args=(name, src, workdir, send))
+    process.start()
+    send.close()
+    try:
+        result = recv.recv()
+    except EOFError:
+        result = {'error': 'benchmark process died'}
+    process.join()
+    return result
+
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return statistics.median(values) if values else None
+
+
+def _meta():
+    import cv2
+    import numpy as np
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        ffmpeg_version = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    except OSError:
+        ffmpeg_version = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'ffmpeg': ffmpeg_version,
+    }
+
+
+def run(out='benchmark.json', sizes='small,medium', cases=None, repeat=3, workdir=None, baseline=None, threshold=THRESHOLD):
+    '''
+    run the benchmarks on synthetic videos, and save the results to out
+
+    sizes: names of SIZES, like 'small,medium,large'
+    cases: names of CASES, defaults to all of them
+    repeat: runs of each case, the median is reported, and the max of peak rss
+    workdir: folder of the synthetic videos and the outputs, they are made once and reused,
+             defaults to a folder in the temp dir
+    baseline: a saved result to compare with, see compare
+    '''
+    sizes = _split(sizes)
+    cases = _split(cases) or list(CASES)
+    for name in cases:
+        if name not in CASES:
+            raise ValueError('Unknown case: {}, cases are {}.'.format(name, ', '.join(CASES)))
+    workdir = workdir or os.path.join(tempfile.gettempdir(), 'viptools-benchmark')
+
+    results = {}
+    for size in sizes:
+        for name in cases:
+            src = get_video(workdir, size, CASES[name][0])
+            runs = [_measure(name, src, workdir) for _ in range(max(1, int(repeat)))]
+            errors = [r['error'] for r in runs if 'error' in r]
+            key = '{}/{}'.format(name, size)
+            if errors:
+                results[key] = {'error': errors[0]}
+                print('{:<32} failed: {}'.format(key, errors[0]))
+                continue
+            results[key] = {
+                'frames': runs[0]['frames'],
+                'seconds': _median([r['seconds'] for r in runs]),
+                'fps': _median([r['fps'] for r in runs]),
+                'ttff': _median([r['ttff'] for r in runs]),
+                'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+                'peak_child_rss_mb': max(r['peak_child_rss_mb'] for r in runs),
+            }
+            print(_format_result(key, results[key]))
+
+    report = {'meta': _meta(), 'results': results}
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        compare(baseline, out, threshold)
+
+
+def _format_fps(fps):
+    return '{:9.1f}'.format(fps) if fps else '        -'
+
+
+def _format_result(key, result):
+    ttff = '{:7.1f} ms'.format(result['ttff'] * 1000) if result['ttff'] is not None else '      - ms'
+    return '{:<32} {} fps  ttff {}  rss {:7.1f} MB  child rss {:7.1f} MB'.format(
+        key, _format_fps(result['fps']), ttff, result['peak_rss_mb'], result['peak_child_rss_mb'])
+
+
+def _load(report):
+    if isinstance(report, dict):
+        return report
+    with open(report) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=THRESHOLD, strict=False):
+    '''
+    compare current results with a baseline, and flag the regressions
+
+    a regression is a drop of fps, or a rise of time to first frame or peak rss,
+    by more than threshold of the baseline.
+    strict: exit with code 1 if there is a regression, for CI
+    return the list of regressions.
+    '''
+    baseline, current = _load(baseline)['results'], _load(current)['results']
+    regressions = []
+    for key in sorted(set(baseline) & set(current)):
+        old, new = baseline[key], current[key]
+        if 'error' in new and 'error' not in old:
+            regressions.append({'case': key, 'metric': 'error', 'baseline': None, 'current': new['error']})
+            continue
+        if 'error' in old or 'error' in new:
+            continue
+        changes = [
+            # a run too short to time has no fps, it is not compared
+            ('fps', bool(old['fps'] and new['fps'] is not None and new['fps'] < old['fps'] * (1 - threshold))),
+            ('ttff', old['ttff'] is not None and new['ttff'] is not None and
+                new['ttff'] > old['ttff'] * (1 + threshold) and new['ttff'] - old['ttff'] > MIN_TTFF_CHANGE),
+            ('peak_rss_mb', new['peak_rss_mb'] > old['peak_rss_mb'] * (1 + threshold)),
+            ('peak_child_rss_mb', new['peak_child_rss_mb'] > old['peak_child_rss_mb'] * (1 + threshold)),
+        ]
+        for metric, regressed in changes:
+            if regressed:
+                regressions.append({'case': key, 'metric': metric, 'baseline': old[metric], 'current': new[metric]})
+
+    for key in sorted(set(baseline) | set(current)):
+        old, new = baseline.get(key), current.get(key)
+        if old is None or new is None or 'error' in old or 'error' in new:
+            continue
+        change = '({:+6.1%})'.format(new['fps'] / old['fps'] - 1) if old['fps'] and new['fps'] is not None else '(     -)'
+        print('{:<32} fps {} -> {} {}'.format(key, _format_fps(old['fps']), _format_fps(new['fps']), change))
+    for regression in regressions:
+        print('REGRESSION {case} {metric}: {baseline} -> {current}'.format(**regression))
+    if not regressions:
+        print('No regression, threshold {:.0%}.'.format(threshold))
+    if strict and regressions:
+        sys.exit(1)
+    return regressions
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+'''
+@Time          : 26/10/18
+@Author        : Freder Chen
+@File          : synthetic.py
+'''
+
+import os
+import cv2
+import numpy as np
+
+
+# name: (width, height, frames)
+SIZES = {
+    'small': (320, 240, 100),
+    'medium': (1280, 720, 150),
+    'large': (1920, 1080, 300),
+}
+
+# extension: opencv fourcc
+FOURCCS = {
+    '.avi': 'MJPG',
+    '.mp4': 'mp4v',
+}
+
+
+def make_frames(width, height, frames, seed=0):
+    '''
+    yield deterministic frames, a moving gradient and box over fixed noise,
+    so the encoders see motion and texture as in a real video
+    '''
+    rng = np.random.RandomState(seed)
+    noise = rng.randint(0, 32, (height, width, 3), dtype=np.uint8)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    box = (max(8, width // 8), max(8, height // 8))
+    for t in range(frames):
+        frame = np.empty((height, width, 3), np.uint8)
+        frame[:, :, 0] = (x + y + 4 * t) % 256
+        frame[:, :, 1] = (x * 0.5 + 2 * t) % 256
+        frame[:, :, 2] = (y * 0.5 + 3 * t) % 256
+        frame += noise
+        bx = (7 * t) % (width - box[0])
+        by = (5 * t) % (height - box[1])
+        frame[by:by + box[1], bx:bx + box[0]] = 255 - frame[by:by + box[1], bx:bx + box[0]]
+        yield frame
+
+
+def make_video(filename, width, height, frames, fps=25, seed=0):
+    '''
+    write a synthetic video by cv2.VideoWriter, the fourcc follows the extension
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in FOURCCS:
+        raise ValueError('filename only supports .avi and .mp4.')
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*FOURCCS[ext]), fps, (width, height))
+    if not writer.isOpened():
+        raise ValueError('Cannot open video writer: {}'.format(filename))
+    for frame in make_frames(width, height, frames, seed):
+        writer.write(frame)
+    writer.release()
+    return filename
+
+
+def get_video(workdir, size, ext='.mp4'):
+    '''
+    the synthetic video of a size in workdir, made once and reused
+    '''
+    if size not in SIZES:
+        raise ValueError('size only supports {}.'.format(', '.join(SIZES)))
+    width, height, frames = SIZES[size]
+    filename = os.path.join(workdir, '{}_{}x{}_{}{}'.format(size, width, height, frames, ext))
+    if not os.path.isfile(filename):
+        os.makedirs(workdir, exist_ok=True)
+        # written aside and renamed, an interrupted run never leaves a short video
+        root, ext = os.path.splitext(filename)
+        make_video(root + '.tmp' + ext, width, height, frames)
+        os.replace(root + '.tmp' + ext, filename)
+    return filename
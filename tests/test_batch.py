@@ -0,0 +1,57 @@
+import os
+import time
+import pytest
+from VIPTools import batch
+from VIPTools.batch import expand_inputs, run_jobs
+
+
+def _fake_job(method, args):
+    # the inputs named crash kill their worker, the others take a while, so they run beside it
+    if 'crash' in args[0]:
+        os._exit(1)
+    time.sleep(0.2)
+    return {'input': args[0], 'output': args[1], 'status': 'ok', 'seconds': 0.2, 'error': None}
+
+
+@pytest.fixture
+def fake_job(monkeypatch):
+    # workers are forked, so they see the patched job
+    monkeypatch.setattr(batch, '_run_job', _fake_job)
+
+
+def test_crash_fails_only_the_crashing_job(fake_job):
+    jobs = [(name, name + '.out', {}) for name in ['a', 'crash', 'b', 'c']]
+    results = {result['input']: result for result in run_jobs('avi2mp4', jobs, max_decoders=4)}
+
+    assert results['crash']['status'] == 'failed'
+    assert results['crash']['crashes'] == batch.MAX_ATTEMPTS
+    for name in ['a', 'b', 'c']:
+        assert results[name]['status'] == 'ok'
+        assert results[name]['crashes'] == 0
+
+
+def test_every_job_has_one_result(fake_job):
+    jobs = [(name, name + '.out', {}) for name in ['a', 'crash1', 'b', 'crash2', 'c', 'd']]
+    results = run_jobs('avi2mp4', jobs, max_decoders=3)
+    assert sorted(result['input'] for result in results) == sorted(job[0] for job in jobs)
+    assert {result['input'] for result in results if result['status'] != 'ok'} == {'crash1', 'crash2'}
+
+
+def test_exception_fails_its_job(tmp_path):
+    # an exception is caught in the worker, it is not a crash
+    results = run_jobs('no_such_method', [('a', str(tmp_path / 'a.mp4'), {})], max_decoders=1)
+    assert results[0]['status'] == 'failed'
+    assert 'AttributeError' in results[0]['error']
+    assert results[0]['crashes'] == 0
+
+
+def test_expand_inputs(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    for name in ['a.mp4', 'b.AVI', 'notes.txt', 'sub/c.mkv']:
+        (tmp_path / name).write_bytes(b'')
+    listed = tmp_path / 'list.lst'
+    listed.write_text('# a comment\n{}\n\nmissing.mp4\n'.format(tmp_path / 'a.mp4'))
+
+    assert expand_inputs(str(tmp_path)) == sorted(str(tmp_path / n) for n in ['a.mp4', 'b.AVI', 'sub/c.mkv'])
+    assert expand_inputs(str(tmp_path / '**' / '*.mkv')) == [str(tmp_path / 'sub' / 'c.mkv')]
+    assert expand_inputs(str(listed)) == sorted([str(tmp_path / 'a.mp4'), 'missing.mp4'])
@@ -0,0 +1,65 @@
+import threading
+import pytest
+from queue import Empty
+from VIPTools.video.frame_queue import FrameQueue, EOS
+
+
+def test_block_policy():
+    queue = FrameQueue(maxsize=2)
+    assert queue.put(1) and queue.put(2)
+    # full, put waits and gives up after the timeout
+    assert not queue.put(3, timeout=0.05)
+    assert not queue.put(3, block=False)
+    assert [queue.get(), queue.get()] == [1, 2]
+    assert queue.dropped == 0
+
+
+def test_block_policy_waits_for_room():
+    queue = FrameQueue(maxsize=1)
+    queue.put(1)
+    threading.Timer(0.05, queue.get).start()
+    assert queue.put(2, timeout=5)
+    assert queue.get() == 2
+
+
+def test_drop_oldest_policy():
+    queue = FrameQueue(maxsize=3, policy='drop_oldest')
+    for i in range(5):
+        assert queue.put(i)
+    assert queue.dropped == 2
+    assert [queue.get() for _ in range(3)] == [2, 3, 4]
+
+
+def test_latest_policy():
+    queue = FrameQueue(maxsize=10, policy='latest')
+    for i in range(5):
+        assert queue.put(i)
+    assert queue.qsize() == 1
+    assert queue.dropped == 4
+    assert queue.get() == 4
+
+
+def test_get_timeout_and_close():
+    queue = FrameQueue()
+    with pytest.raises(Empty):
+        queue.get(timeout=0.01)
+    queue.put(1)
+    queue.close()
+    # queued items are still read after close, then EOS
+    assert queue.peek() == 1
+    assert queue.get() == 1
+    assert queue.get() is EOS
+    assert not queue.put(2)
+
+
+def test_close_wakes_up_waiters():
+    queue = FrameQueue(maxsize=1)
+    queue.put(1)
+    threading.Timer(0.05, queue.close, kwargs={'clear': True}).start()
+    assert not queue.put(2, timeout=5)
+    assert queue.get() is EOS
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        FrameQueue(policy='newest')
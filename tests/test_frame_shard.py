@@ -0,0 +1,69 @@
+import pickle
+import numpy as np
+import pytest
+from VIPTools.frame_shard import FrameShardWriter, FrameShardReader, is_frame_shard
+
+
+def _frame(value):
+    return np.full((4, 6, 3), value, np.uint8)
+
+
+@pytest.fixture
+def shard(tmp_path):
+    # frame indices written out of order, with gaps, and a small shard size to span shards
+    path = str(tmp_path / 'shard')
+    with FrameShardWriter(path, encoding='raw', shard_size=200) as writer:
+        for index in [30, 10, 20, 50, 40]:
+            writer.write(index, _frame(index))
+    return path
+
+
+def test_get_by_frame_index(shard):
+    reader = FrameShardReader(shard)
+    assert is_frame_shard(shard)
+    assert len(reader) == 5
+    assert reader.meta['shards'] > 1
+    for index in [10, 20, 30, 40, 50]:
+        assert (reader.get(index) == index).all()
+
+
+def test_get_missing_index(shard):
+    reader = FrameShardReader(shard)
+    for index in [0, 15, 60]:
+        with pytest.raises(KeyError):
+            reader.get(index)
+
+
+def test_position_order(shard):
+    reader = FrameShardReader(shard)
+    assert list(reader.indices) == [30, 10, 20, 50, 40]
+    assert [int(frame[0, 0, 0]) for frame in reader] == [30, 10, 20, 50, 40]
+
+
+def test_pickled_reader(shard):
+    reader = FrameShardReader(shard)
+    reader.get(10)
+    reader = pickle.loads(pickle.dumps(reader))
+    assert (reader.get(50) == 50).all()
+
+
+def test_encoded_frames(tmp_path):
+    path = str(tmp_path / 'png')
+    with FrameShardWriter(path, encoding='png', workers=2) as writer:
+        for index in range(8):
+            writer.write(index, _frame(index * 10))
+    reader = FrameShardReader(path)
+    assert [int(frame[0, 0, 0]) for frame in reader.frames(workers=2)] == [i * 10 for i in range(8)]
+    assert (reader.get(3) == 30).all()
+
+
+def test_aborted_writer_is_incomplete(tmp_path):
+    path = str(tmp_path / 'aborted')
+    with pytest.raises(RuntimeError):
+        with FrameShardWriter(path, encoding='raw') as writer:
+            for index in range(10):
+                writer.write(index, _frame(index))
+            raise RuntimeError('decode failed')
+    assert not is_frame_shard(path)
+    with pytest.raises(ValueError):
+        FrameShardReader(path)
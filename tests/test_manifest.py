@@ -0,0 +1,65 @@
+import os
+import json
+from VIPTools.manifest import Manifest, manifest_filename, output_identity
+
+
+def _source(tmp_path):
+    source = tmp_path / 'src.mp4'
+    source.write_bytes(b'video')
+    return str(source)
+
+
+def test_manifest_filename(tmp_path):
+    assert manifest_filename(str(tmp_path)) == os.path.join(str(tmp_path), '.manifest.json')
+    assert manifest_filename(str(tmp_path / 'out.mp4')) == os.path.join(str(tmp_path), '.out.mp4.manifest.json')
+
+
+def test_finished_file_is_done_until_changed(tmp_path):
+    source = _source(tmp_path)
+    output = tmp_path / 'out.mp4'
+    output.write_bytes(b'clip')
+    Manifest(manifest_filename(str(output)), source, {'mode': 'copy'}).finish_output(str(output))
+
+    manifest = Manifest(manifest_filename(str(output)), source, {'mode': 'copy'})
+    assert manifest.done and manifest.output_done(str(output))
+    output.write_bytes(b'another clip')
+    assert not Manifest(manifest_filename(str(output)), source, {'mode': 'copy'}).done
+
+
+def test_finished_folder_is_not_done_after_files_are_lost(tmp_path):
+    source = _source(tmp_path)
+    imgdir = tmp_path / 'imgs'
+    imgdir.mkdir()
+    for i in range(3):
+        (imgdir / '{}.jpg'.format(i + 1)).write_bytes(b'jpg')
+    Manifest(manifest_filename(str(imgdir)), source, {}).finish_output(str(imgdir))
+
+    # the manifest itself is hidden and not counted
+    assert output_identity(str(imgdir))['files'] == 3
+    assert Manifest(manifest_filename(str(imgdir)), source, {}).output_done(str(imgdir))
+    os.remove(str(imgdir / '2.jpg'))
+    assert not Manifest(manifest_filename(str(imgdir)), source, {}).done
+
+
+def test_state_is_dropped_when_source_or_params_change(tmp_path):
+    source = _source(tmp_path)
+    filename = str(tmp_path / '.manifest.json')
+    Manifest(filename, source, {'step': 1}).update(last_frame=99)
+
+    assert Manifest(filename, source, {'step': 1}).get('last_frame') == 99
+    assert Manifest(filename, source, {'step': 2}).get('last_frame') is None
+    with open(source, 'ab') as f:
+        f.write(b'more')
+    assert Manifest(filename, source, {'step': 1}).get('last_frame') is None
+
+
+def test_broken_manifest_starts_again(tmp_path):
+    source = _source(tmp_path)
+    filename = str(tmp_path / '.manifest.json')
+    with open(filename, 'w') as f:
+        f.write('{broken')
+    manifest = Manifest(filename, source, {})
+    assert not manifest.done
+    manifest.update(last_frame=1)
+    with open(filename) as f:
+        assert json.load(f)['state'] == {'last_frame': 1}
@@ -0,0 +1,74 @@
+import json
+import pytest
+from VIPTools.video.metrics import Histogram, Metrics, JsonLinesExporter, format_stats, get_metrics
+
+
+def test_histogram_buckets():
+    histogram = Histogram()
+    # 1 us, 3 us, 1 ms and 1 s fall into buckets of upper bounds 2 us, 4 us, 1.024 ms and 1.048576 s
+    for value in [1e-6, 3e-6, 1e-3, 1.0]:
+        histogram.add(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 4
+    assert snapshot['min'] == 1e-6 and snapshot['max'] == 1.0
+    assert snapshot['mean'] == pytest.approx((1e-6 + 3e-6 + 1e-3 + 1.0) / 4)
+    assert snapshot['buckets'] == {'2e-06': 1, '4e-06': 1, '0.001024': 1, '1.04858': 1}
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for _ in range(99):
+        histogram.add(1e-3)
+    histogram.add(0.5)
+    # a percentile is the upper bound of its bucket, clipped by the max
+    assert histogram.percentile(0.5) == pytest.approx(1.024e-3)
+    assert histogram.percentile(0.99) == pytest.approx(1.024e-3)
+    assert histogram.percentile(1.0) == 0.5
+    assert Histogram().percentile(0.5) is None
+
+
+def test_histogram_clips_values():
+    histogram = Histogram()
+    histogram.add(-1.0)
+    histogram.add(1e9)
+    assert histogram.buckets[0] == 1
+    assert histogram.buckets[-1] == 1
+
+
+def test_metrics_stats():
+    metrics = Metrics('test')
+    with metrics.timer('encode'):
+        pass
+    assert list(metrics.timed('decode', range(3))) == [0, 1, 2]
+    metrics.count('frames', 3)
+    metrics.gauge('queue', 2)
+    metrics.gauge('queue', 4)
+    stats = metrics.stats()
+    assert stats['stages']['encode']['count'] == 1
+    assert stats['stages']['decode']['count'] == 3
+    assert stats['counters'] == {'frames': 3}
+    assert stats['gauges']['queue'] == {'last': 4, 'max': 4, 'mean': 3}
+    assert stats['fps'] > 0
+    assert format_stats(stats).startswith('test:')
+
+
+def test_disabled_metrics():
+    metrics = get_metrics()
+    assert not metrics.enabled
+    with metrics.timer('encode'):
+        pass
+    metrics.count('frames')
+    assert metrics.stats()['stages'] == {} and metrics.stats()['counters'] == {}
+
+
+def test_children_are_exported(tmp_path):
+    filename = str(tmp_path / 'stats.jsonl')
+    lines = []
+    metrics = Metrics('parent', exporters=[JsonLinesExporter(filename)], log=lines.append)
+    metrics.child('child').count('frames', 2)
+    metrics.export()
+    with open(filename) as f:
+        stats = json.loads(f.readline())
+    assert stats['children'][0]['name'] == 'child'
+    assert stats['children'][0]['counters'] == {'frames': 2}
+    assert 'child:' in lines[0]
@@ -0,0 +1,36 @@
+from VIPTools.parallel import split_segments
+
+
+def test_segments_start_at_keyframes():
+    keyframes = [0, 30, 60, 90, 120, 150]
+    segments = split_segments(keyframes, 0, 180, 3)
+    assert segments == [(0, 60), (60, 120), (120, 180)]
+
+
+def test_segments_cover_the_range():
+    keyframes = list(range(0, 1000, 25))
+    segments = split_segments(keyframes, 10, 910, 7)
+    assert segments[0][0] == 10 and segments[-1][1] == 910
+    for (_, end), (start, _) in zip(segments, segments[1:]):
+        assert end == start
+        assert start in keyframes
+
+
+def test_nearest_keyframe_to_the_even_split():
+    # the even split is at 50, 48 is nearer than 70
+    assert split_segments([0, 48, 70], 0, 100, 2) == [(0, 48), (48, 100)]
+
+
+def test_fewer_keyframes_than_segments():
+    assert split_segments([0, 50], 0, 100, 8) == [(0, 50), (50, 100)]
+    assert split_segments([0], 0, 100, 8) == [(0, 100)]
+
+
+def test_keyframes_outside_the_range_are_not_bounds():
+    assert split_segments([0, 10, 200], 20, 100, 4) == [(20, 100)]
+
+
+def test_end_of_video():
+    # end_frame None splits by frame_count and keeps None as the last end
+    segments = split_segments([0, 40, 80], 0, None, 3, frame_count=120)
+    assert segments == [(0, 40), (40, 80), (80, None)]
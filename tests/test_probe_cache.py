@@ -0,0 +1,67 @@
+import os
+import json
+import pytest
+from VIPTools.video import probe_cache
+from VIPTools.video.probe_cache import ProbeCache
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    # count the probes instead of running ffprobe
+    calls = []
+    def probe_stream(uri, **probe_args):
+        calls.append(uri)
+        return {'codec_name': 'h264', 'width': 320, 'height': 240}
+    monkeypatch.setattr(probe_cache, 'probe_stream', probe_stream)
+    return calls
+
+
+def test_file_is_probed_once(tmp_path, probes):
+    filename = tmp_path / 'a.mp4'
+    filename.write_bytes(b'video')
+    cache = ProbeCache()
+    assert cache.probe(str(filename)) == cache.probe(str(filename))
+    assert len(probes) == 1
+
+
+def test_changed_file_is_probed_again(tmp_path, probes):
+    filename = tmp_path / 'a.mp4'
+    filename.write_bytes(b'video')
+    cache = ProbeCache()
+    cache.probe(str(filename))
+    filename.write_bytes(b'another video')
+    cache.probe(str(filename))
+    assert len(probes) == 2
+
+
+def test_live_source_is_not_cached(probes):
+    cache = ProbeCache()
+    cache.probe('rtsp://camera/stream')
+    cache.probe('rtsp://camera/stream')
+    assert len(probes) == 2
+    assert len(cache.entries) == 0
+
+
+def test_save_and_load(tmp_path, probes):
+    filename = tmp_path / 'a.mp4'
+    filename.write_bytes(b'video')
+    cache_filename = str(tmp_path / 'probe.json')
+    cache = ProbeCache(cache_filename)
+    cache.probe(str(filename))
+    cache.save()
+    with open(cache_filename) as f:
+        assert len(json.load(f)) == 1
+
+    cache = ProbeCache(cache_filename)
+    cache.probe(str(filename))
+    assert len(probes) == 1
+
+
+def test_maxsize(tmp_path, probes):
+    cache = ProbeCache(maxsize=2)
+    for name in ['a', 'b', 'c']:
+        (tmp_path / name).write_bytes(b'video')
+        cache.probe(str(tmp_path / name))
+    assert len(cache.entries) == 2
+    cache.probe(str(tmp_path / 'a'))
+    assert len(probes) == 4
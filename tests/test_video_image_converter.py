@@ -0,0 +1,47 @@
+import pytest
+from VIPTools.video_image_converter import sample_range
+
+
+def kept(fps, frames, **options):
+    start_frame, end_frame, keep = sample_range(fps, **options)
+    end_frame = frames if end_frame is None else min(end_frame, frames)
+    return [i for i in range(start_frame, end_frame) if keep(i)]
+
+
+def test_all_frames():
+    assert sample_range(25)[:2] == (0, None)
+    assert kept(25, 10) == list(range(10))
+
+
+def test_step():
+    assert kept(25, 20, step=5) == [0, 5, 10, 15]
+
+
+def test_time_range():
+    # [1s, 2s) at 25 fps
+    assert sample_range(25, start_time=1, end_time=2)[:2] == (25, 50)
+    assert kept(25, 100, start_time=1, end_time=2) == list(range(25, 50))
+
+
+def test_step_follows_start_frame():
+    assert kept(25, 100, step=10, start_time=1, end_time=2) == [25, 35, 45]
+
+
+@pytest.mark.parametrize('fps, sample_fps', [(25, 1), (30, 2), (29.97, 1), (30, 7)])
+def test_sample_fps(fps, sample_fps):
+    # one frame in each 1 / sample_fps interval
+    indices = kept(fps, int(fps * 10), sample_fps=sample_fps)
+    assert len(indices) == pytest.approx(10 * sample_fps, abs=1)
+    assert indices[0] == 0
+    for i in indices:
+        assert sum(int(j * sample_fps / fps) == int(i * sample_fps / fps) for j in indices) == 1
+
+
+def test_sample_fps_above_fps_keeps_every_frame():
+    assert kept(10, 20, sample_fps=30) == list(range(20))
+
+
+def test_sample_fps_from_start_time():
+    # the intervals start at start_frame, frames 62 to 249 are 7.5 seconds
+    indices = kept(25, 250, sample_fps=1, start_time=2.5)
+    assert indices == [62 + 25 * i for i in range(8)]